@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from app.utils import CACHE_HITS, CACHE_MISSES
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire ttl seconds after being set.
+    Not shared between workers, so ttl bounds how stale an entry can be.
+    on_evict is called with every value leaving the cache.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self.pop(key)
+            CACHE_MISSES.labels(cache=self.name).inc()
+            return None
+        self.entries.move_to_end(key)
+        CACHE_HITS.labels(cache=self.name).inc()
+        return entry[1]
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        # Like get() without counting a hit or miss
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        # ttl can only shorten the cache ttl
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        self.pop(key)
+        self.entries[key] = (time.monotonic() + ttl, value)
+        while len(self.entries) > self.maxsize:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        if self.on_evict is not None:
+            self.on_evict(entry[1])
+        return entry[1]
+
+    def clear(self) -> None:
+        while self.entries:
+            self.pop(next(iter(self.entries)))
+
+    def __len__(self) -> int:
+        return len(self.entries)
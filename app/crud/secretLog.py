@@ -1,28 +1,115 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event, insert, select
 from sqlalchemy.orm import Session
-from app.models.secretLogs import SecretLogs
 
+from app.database import AnySession, maybe_await
+from app.log_writer import AUDIT_LOG_MODE, secret_log_writer
+from app.models.secretLogs import SecretLogs
+from app.pagination import paginate
 
-def read_secret_logs(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(SecretLogs).offset(skip).limit(limit).all()
+# Session.info key of the logs recorded in "buffered" mode, see commit_with_logs
+PENDING_LOGS = "pending_secret_logs"
 
 
-def read_secret_log(db: Session, secret_uuid: str, skip: int = 0, limit: int = 10):
-    return (
-        db.query(SecretLogs)
-        .filter(SecretLogs.secret_id == secret_uuid)
-        .offset(skip)
-        .limit(limit)
-        .all()
+async def read_secret_logs(
+    db: AnySession, skip: int = 0, limit: int = 10, cursor: Optional[str] = None
+):
+    query = paginate(
+        select(SecretLogs), SecretLogs.timestamp, SecretLogs.uuid, skip, limit, cursor
     )
+    result = await maybe_await(db.scalars(query))
+    return result.all()
 
 
-def create_secret_logs(db: Session, secret_uuid: str, action: str):
+async def read_secret_log(
+    db: AnySession,
+    secret_uuid: str,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+):
+    query = paginate(
+        select(SecretLogs).filter(SecretLogs.secret_id == secret_uuid),
+        SecretLogs.timestamp,
+        SecretLogs.uuid,
+        skip,
+        limit,
+        cursor,
+    )
+    result = await maybe_await(db.scalars(query))
+    return result.all()
 
+
+async def create_secret_logs(
+    db: AnySession, secret_uuid: str, action: str, commit: bool = True
+):
+    """
+    With commit=False the log is only added to the session, so it is written
+    in the caller's transaction.
+    """
+    # Set here rather than by now(), which is the same for every log of a
+    # transaction, so logs keep their creation order in (timestamp, uuid)
     secret_log = SecretLogs(
+        uuid=uuid.uuid4(),
         secret_id=secret_uuid,
         action=action,
+        timestamp=datetime.now(timezone.utc),
     )
     db.add(secret_log)
-    db.commit()
-    db.refresh(secret_log)
+    if not commit:
+        return secret_log
+    await maybe_await(db.commit())
+    await maybe_await(db.refresh(secret_log))
     return secret_log
+
+
+async def record_secret_log(db: AnySession, secret_uuid, action: str) -> None:
+    """
+    Audit log of an operation on a secret: written in the caller's transaction
+    in "sync" mode, handed to the buffered writer by commit_with_logs in
+    "buffered" mode.
+    """
+    if AUDIT_LOG_MODE == "buffered":
+        db.info.setdefault(PENDING_LOGS, []).append((secret_uuid, action))
+    else:
+        await create_secret_logs(db, secret_uuid, action, commit=False)
+
+
+async def record_secret_logs(db: AnySession, secret_uuids: list, action: str) -> None:
+    """
+    record_secret_log for many secrets, with one multi-row INSERT in "sync" mode.
+    """
+    if AUDIT_LOG_MODE == "buffered":
+        db.info.setdefault(PENDING_LOGS, []).extend(
+            (secret_uuid, action) for secret_uuid in secret_uuids
+        )
+    elif secret_uuids:
+        rows = [
+            {
+                "uuid": uuid.uuid4(),
+                "secret_id": secret_uuid,
+                "action": action,
+                "timestamp": datetime.now(timezone.utc),
+            }
+            for secret_uuid in secret_uuids
+        ]
+        await maybe_await(db.execute(insert(SecretLogs.__table__), rows))
+
+
+async def commit_with_logs(db: AnySession) -> None:
+    """
+    Commits the caller's transaction, then hands the logs it recorded in
+    "buffered" mode to the writer, so a failed commit writes no log.
+    """
+    pending = db.info.pop(PENDING_LOGS, [])
+    await maybe_await(db.commit())
+    for secret_uuid, action in pending:
+        await secret_log_writer.enqueue(secret_uuid, action)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_logs(session: Session) -> None:
+    session.info.pop(PENDING_LOGS, None)
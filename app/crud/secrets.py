@@ -1,79 +1,234 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterable, AsyncIterator, Optional
 
-from app.crud.secretLog import create_secret_logs
-from app.crypting import encrypt_text
-from app.events import secret_created_event
-from app.hash_manager import hash_password, verify_password
+from app.cache import TTLCache
+from app.crud.secretLog import (
+    commit_with_logs,
+    record_secret_log,
+    record_secret_logs,
+)
+from app.crypting import (
+    StreamEncryptor,
+    decrypt_text,
+    encrypt_stream,
+    encrypt_text,
+    is_legacy_encrypted,
+    iter_chunks,
+)
+from app.database import AnySession, maybe_await
+from app.events import notify_count_change, secret_counter
+from app.hash_manager import hashing_service
+from app.key_cache import derived_key_cache
 from app.models.secret import Secret
 from app.models.secretContent import SecretContent
 from app.models.secretFileContent import SecretFileContent
+from app.models.secretLogs import SecretLogs
 from app.models.secretTextContent import SecretTextContent
+
+# Registers User, which with_polymorphic below needs to configure the mappers
 from app.models.user import User
-from app.schemas.secret import SecretCreate, SecretCreateFile, SecretCreateText
+from app.pagination import paginate
+from app.schemas.secret import (
+    SecretCreate,
+    SecretCreateFile,
+    SecretCreateText,
+    SecretType,
+)
 from app.schemas.secretLog import SecretLogActionEnum
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from app.schemas.user import UserPrincipal
+from app.storage import BLOB_STORAGE_THRESHOLD, blob_storage
+from app.utils import phase, phase_chunks
+from sqlalchemy import and_, case, delete, func, insert, or_, select, update
+from sqlalchemy.orm import selectinload, undefer, with_polymorphic
+from sqlalchemy.orm.attributes import set_committed_value
 
 logger = logging.getLogger(__name__)
 
+SECRET_TYPE_CACHE_SIZE = int(os.environ.get("SECRET_TYPE_CACHE_SIZE", 4096))
+SECRET_TYPE_CACHE_TTL = float(os.environ.get("SECRET_TYPE_CACHE_TTL", 3600))
+# Seconds a used up secret is kept before the sweeper may purge it: a file
+# download only opens its blob once the response starts streaming
+SECRET_PURGE_GRACE = float(os.environ.get("SECRET_PURGE_GRACE", 60))
 
-def read_secret_type(db: Session, secret_uuid: str) -> str | None:
-    secret = db.query(Secret).filter(Secret.uuid == secret_uuid).first()
-    if secret:
-        return secret.content.type
-    else:
-        return None
+# Relationships and payload columns are never lazy loaded: the content is
+# loaded with these options, and its payload only by the decrypt paths
+any_content = with_polymorphic(SecretContent, [SecretTextContent, SecretFileContent])
+payload_options = (
+    undefer(any_content.SecretTextContent.content),
+    undefer(any_content.SecretFileContent.content),
+)
+content_loader = selectinload(Secret.content.of_type(any_content)).options(
+    *payload_options
+)
 
+# A secret's type never changes
+secret_type_cache = TTLCache(
+    "secret_type", SECRET_TYPE_CACHE_SIZE, SECRET_TYPE_CACHE_TTL
+)
 
-def read_secret(db: Session, secret_uuid: str, password: str):
-    secret = (
-        db.query(Secret)
-        .filter(
-            Secret.uuid == secret_uuid,
-            or_(Secret.destruction == None, Secret.destruction > datetime.now()),
-            or_(Secret.usage_limit == None, Secret.usage_limit > Secret.usage_count),
+
+async def read_secret_type(db: AnySession, secret_uuid: str) -> str | None:
+    secret_type = secret_type_cache.get(str(secret_uuid))
+    if secret_type is None:
+        secret_type = await maybe_await(
+            db.scalar(
+                select(SecretContent.type)
+                .join(Secret, Secret.content_id == SecretContent.uuid)
+                .filter(Secret.uuid == secret_uuid)
+            )
         )
-        .first()
+        if secret_type is not None:
+            secret_type_cache.set(str(secret_uuid), secret_type)
+    return secret_type
+
+
+def secret_is_available():
+    return (
+        or_(Secret.destruction == None, Secret.destruction > datetime.now()),
+        or_(Secret.usage_limit == None, Secret.usage_limit > Secret.usage_count),
     )
-    if secret and verify_password(password, secret.hashed_password):
-        secret.usage_count += 1
-        create_secret_logs(db, secret_uuid, SecretLogActionEnum.GET)
-        if secret.usage_limit and secret.usage_limit >= secret.usage_count:
-            create_secret_logs(db, secret_uuid, SecretLogActionEnum.EXPIRE)
-        db.commit()
-        db.refresh(secret)
-        return secret
-    else:
+
+
+async def load_content(db: AnySession, secret: Secret) -> SecretContent:
+    content = await maybe_await(
+        db.scalar(
+            select(any_content)
+            .options(*payload_options)
+            .filter(any_content.uuid == secret.content_id)
+        )
+    )
+    set_committed_value(secret, "content", content)
+    return content
+
+
+async def read_secret(db: AnySession, secret_uuid: str, password: str):
+    with phase("read", "db_query", query="select_secret"):
+        secret = await maybe_await(
+            db.scalar(
+                select(Secret).filter(
+                    Secret.uuid == secret_uuid, *secret_is_available()
+                )
+            )
+        )
+    if not secret:
         return None
+    # A password recently verified for this secret skips PBKDF2
+    verified = derived_key_cache.verify(secret.uuid, password)
+    if not verified:
+        with phase("read", "hash"):
+            if not await hashing_service.verify_password(
+                password, secret.hashed_password
+            ):
+                return None
 
+    # The availability check is repeated in the UPDATE so concurrent readers
+    # can never consume more uses than usage_limit allows
+    with phase("read", "db_query", query="consume_use"):
+        usage_count = await maybe_await(
+            db.scalar(
+                update(Secret)
+                .filter(Secret.uuid == secret.uuid, *secret_is_available())
+                .values(
+                    usage_count=Secret.usage_count + 1,
+                    # The last use makes the secret due for the sweeper, which
+                    # only range scans destruction
+                    destruction=case(
+                        (
+                            Secret.usage_limit == Secret.usage_count + 1,
+                            datetime.now() + timedelta(seconds=SECRET_PURGE_GRACE),
+                        ),
+                        else_=Secret.destruction,
+                    ),
+                )
+                .returning(Secret.usage_count)
+                .execution_options(synchronize_session=False)
+            )
+        )
+    if usage_count is None:
+        await maybe_await(db.rollback())
+        derived_key_cache.invalidate(secret.uuid)
+        return None
 
-def read_user_secrets(db: Session, user: User, skip: int = 0, limit: int = 10):
-    if user.is_admin:
-        return db.query(Secret).offset(skip).limit(limit).all()
-    return (
-        db.query(Secret)
-        .filter(Secret.user_uuid == user.uuid)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    # The payload is only read once the password is verified and a use consumed
+    with phase("read", "db_query", query="load_content"):
+        await load_content(db, secret)
+    set_committed_value(secret, "usage_count", usage_count)
+    await record_secret_log(db, secret.uuid, SecretLogActionEnum.GET)
+    if secret.usage_limit and secret.usage_limit == usage_count:
+        await record_secret_log(db, secret.uuid, SecretLogActionEnum.EXPIRE)
+        derived_key_cache.invalidate(secret.uuid)
+    elif not verified:
+        derived_key_cache.put(secret.uuid, password, secret.destruction)
+    with phase("read", "db_commit"):
+        await commit_with_logs(db)
+    return secret
+
+
+def content_needs_migration(secret: Secret) -> bool:
+    exhausted = secret.usage_limit and secret.usage_count >= secret.usage_limit
+    # Payloads in the blob storage were always written in the chunked format
+    inline = secret.content.content is not None
+    return not exhausted and inline and is_legacy_encrypted(secret.content.content)
+
+
+async def migrate_legacy_content(db: AnySession, secret_uuid, password: str):
+    """
+    Re-encrypts a legacy Fernet payload in the binary formats. This can only
+    happen while a reader has just presented the password.
+    """
+    secret = await maybe_await(
+        db.scalar(
+            select(Secret)
+            .options(content_loader)
+            .filter(Secret.uuid == secret_uuid, *secret_is_available())
+        )
     )
+    if secret is None or not content_needs_migration(secret):
+        return None
+
+    decrypted_content = decrypt_text(secret.content.content, password)
+    if secret.content.type == SecretType.FILE.value:
+        encryptor = StreamEncryptor(password)
+        secret.content.content = (
+            encryptor.update(decrypted_content) + encryptor.finalize()
+        )
+    else:
+        secret.content.content = encrypt_text(decrypted_content, password)
+    await maybe_await(db.commit())
+    return secret
 
 
-def create_secret_from_text(
-    db: Session, user: Optional[User], secret_create_text: SecretCreateText
+async def read_user_secrets(
+    db: AnySession,
+    user: UserPrincipal,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: Optional[str] = None,
 ):
-    content = SecretTextContent(
-        content=encrypt_text(
-            secret_create_text.text_content.encode(),
-            secret_create_text.password,
+    query = select(Secret)
+    if not user.is_admin:
+        query = query.filter(Secret.user_uuid == user.uuid)
+    query = paginate(query, Secret.creation, Secret.uuid, skip, limit, cursor)
+    result = await maybe_await(db.scalars(query))
+    return result.all()
+
+
+async def create_secret_from_text(
+    db: AnySession, user: Optional[UserPrincipal], secret_create_text: SecretCreateText
+):
+    payload = secret_create_text.text_content.encode()
+    with phase("create", "encrypt", payload_size=len(payload)):
+        content = SecretTextContent(
+            content=encrypt_text(payload, secret_create_text.password)
         )
-    )
     secret_create = SecretCreate(
         **secret_create_text.__dict__,
     )
-    return create_secret(
+    return await create_secret(
         db,
         user=user,
         content=content,
@@ -81,36 +236,96 @@ def create_secret_from_text(
     )
 
 
-def create_secret_from_file(
-    db: Session, user: Optional[User], secret_create_file: SecretCreateFile
+async def store_file_payload(
+    encrypted_chunks: AsyncIterator[bytes],
+) -> tuple[Optional[bytes], Optional[str]]:
+    """
+    Keeps payloads up to BLOB_STORAGE_THRESHOLD inline and streams bigger ones
+    to the blob storage. Returns the inline content or the storage key.
+    """
+    buffered = []
+    buffered_size = 0
+    async for chunk in encrypted_chunks:
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if blob_storage is not None and buffered_size > BLOB_STORAGE_THRESHOLD:
+
+            async def remaining_chunks():
+                while buffered:
+                    yield buffered.pop(0)
+                async for chunk in encrypted_chunks:
+                    yield chunk
+
+            return None, await blob_storage.put_stream(remaining_chunks())
+    return b"".join(buffered), None
+
+
+def iter_file_content(content: SecretFileContent) -> AsyncIterator[bytes]:
+    if content.storage_key is not None:
+        return blob_storage.iter_object(content.storage_key)
+    return iter_chunks(content.content)
+
+
+async def create_secret_from_file(
+    db: AnySession,
+    user: Optional[UserPrincipal],
+    secret_create_file: SecretCreateFile,
+    file_chunks: AsyncIterable[bytes],
 ):
+    size = 0
+
+    async def counted_chunks():
+        nonlocal size
+        async for chunk in file_chunks:
+            size += len(chunk)
+            yield chunk
+
+    # The encrypt phase includes receiving the upload, which is read as it is
+    # encrypted
+    encrypted_content, storage_key = await store_file_payload(
+        phase_chunks(
+            "create",
+            "encrypt",
+            encrypt_stream(counted_chunks(), secret_create_file.password),
+        )
+    )
     content = SecretFileContent(
-        content=encrypt_text(
-            secret_create_file.file_content,
-            secret_create_file.password,
-        ),
+        content=encrypted_content,
+        storage_key=storage_key,
+        size=size,
         filename=secret_create_file.filename,
     )
     secret_create = SecretCreate(
         **secret_create_file.__dict__,
     )
-    return create_secret(
-        db,
-        user=user,
-        content=content,
-        secret_create=secret_create,
-    )
+    try:
+        return await create_secret(
+            db,
+            user=user,
+            content=content,
+            secret_create=secret_create,
+        )
+    except Exception:
+        if storage_key is not None:
+            await blob_storage.delete_object(storage_key)
+        raise
 
 
-def create_secret(
-    db: Session,
-    user: Optional[User],
+async def create_secret(
+    db: AnySession,
+    user: Optional[UserPrincipal],
     secret_create: SecretCreate,
     content: SecretContent,
 ):
     now = datetime.now()
+    with phase("create", "hash"):
+        hashed_password = await hashing_service.hash_password(secret_create.password)
 
+    # Keys are generated here so the content, secret and CREATE log rows can be
+    # flushed in one transaction without reading anything back
+    content.uuid = uuid.uuid4()
     db_secret = Secret(
+        uuid=uuid.uuid4(),
         creation=now,
         destruction=(
             now + timedelta(minutes=secret_create.duration)
@@ -118,18 +333,165 @@ def create_secret(
             else None
         ),
         usage_limit=secret_create.usage_limit if secret_create.usage_limit else None,
-        hashed_password=hash_password(secret_create.password),
+        hashed_password=hashed_password,
         content=content,
         user_uuid=user.uuid if user else None,
     )
 
     db.add(db_secret)
-    db.commit()
-    db.refresh(db_secret)
-    secret_created_event.set()
-    create_secret_logs(db, db_secret.uuid, SecretLogActionEnum.CREATE)
+    await record_secret_log(db, db_secret.uuid, SecretLogActionEnum.CREATE)
+    await notify_count_change(db, 1)
+    # The content, secret and log rows are flushed by the commit
+    with phase("create", "db_commit"):
+        await commit_with_logs(db)
+    secret_counter.add(1)
     return db_secret
 
 
-def count_secrets(db: Session):
-    return db.query(Secret).count()
+async def create_secrets_from_text(
+    db: AnySession,
+    user: Optional[UserPrincipal],
+    secrets_create_text: list[SecretCreateText],
+) -> list:
+    """
+    Creates text secrets in bulk: passwords are hashed and contents encrypted
+    on the hashing workers, then the content, secret and CREATE log rows are
+    written with one multi-row INSERT per table in a single transaction.
+    Returns, in order, the uuid of each created secret or the exception that
+    prevented its creation.
+    """
+    # The batch never takes more than one job per worker, leaving the rest of
+    # HASH_MAX_PENDING to other requests
+    workers = asyncio.Semaphore(hashing_service.workers)
+
+    async def hash_and_encrypt(secret_create_text: SecretCreateText):
+        async with workers:
+            return await hashing_service.hash_and_encrypt(
+                secret_create_text.password, secret_create_text.text_content.encode()
+            )
+
+    with phase("create_batch", "hash", secrets=len(secrets_create_text)):
+        prepared = await asyncio.gather(
+            *(hash_and_encrypt(secret) for secret in secrets_create_text),
+            return_exceptions=True,
+        )
+
+    now = datetime.now()
+    results = []
+    content_rows = []
+    text_content_rows = []
+    secret_rows = []
+    for secret_create_text, result in zip(secrets_create_text, prepared):
+        if isinstance(result, BaseException):
+            results.append(result)
+            continue
+        hashed_password, encrypted_content = result
+        content_uuid = uuid.uuid4()
+        secret_uuid = uuid.uuid4()
+        content_rows.append({"uuid": content_uuid, "type": SecretType.TEXT.value})
+        text_content_rows.append({"uuid": content_uuid, "content": encrypted_content})
+        secret_rows.append(
+            {
+                "uuid": secret_uuid,
+                "creation": now,
+                "destruction": (
+                    now + timedelta(minutes=secret_create_text.duration)
+                    if secret_create_text.duration
+                    else None
+                ),
+                "usage_count": 0,
+                "usage_limit": secret_create_text.usage_limit or None,
+                "hashed_password": hashed_password,
+                "user_uuid": user.uuid if user else None,
+                "content_id": content_uuid,
+            }
+        )
+        results.append(secret_uuid)
+
+    if not secret_rows:
+        return results
+
+    with phase("create_batch", "db_commit", secrets=len(secret_rows)):
+        await maybe_await(db.execute(insert(SecretContent.__table__), content_rows))
+        await maybe_await(
+            db.execute(insert(SecretTextContent.__table__), text_content_rows)
+        )
+        await maybe_await(db.execute(insert(Secret.__table__), secret_rows))
+        secret_uuids = [row["uuid"] for row in secret_rows]
+        await record_secret_logs(db, secret_uuids, SecretLogActionEnum.CREATE)
+        await notify_count_change(db, len(secret_rows))
+        await commit_with_logs(db)
+    secret_counter.add(len(secret_rows))
+    return results
+
+
+async def count_secrets(db: AnySession):
+    return await maybe_await(db.scalar(select(func.count()).select_from(Secret)))
+
+
+async def purge_expired_secrets(db: AnySession, batch_size: int = 500) -> int:
+    """
+    Deletes up to batch_size expired or used up secrets with their content in
+    one transaction. read_secret sets the destruction of a secret to its last
+    use plus SECRET_PURGE_GRACE, so both are found by destruction alone. Time-expired secrets get
+    their EXPIRE log here, used up ones already got it from read_secret.
+    """
+    used_up = and_(
+        Secret.usage_limit != None, Secret.usage_count >= Secret.usage_limit
+    ).label("used_up")
+    result = await maybe_await(
+        db.execute(
+            select(Secret.uuid, Secret.content_id, used_up)
+            .filter(Secret.destruction <= datetime.now())
+            .limit(batch_size)
+        )
+    )
+    expired = result.all()
+    if not expired:
+        return 0
+
+    secret_uuids = [secret.uuid for secret in expired]
+    content_uuids = [secret.content_id for secret in expired]
+    storage_keys = (
+        await maybe_await(
+            db.scalars(
+                select(SecretFileContent.storage_key).filter(
+                    SecretFileContent.uuid.in_(content_uuids),
+                    SecretFileContent.storage_key != None,
+                )
+            )
+        )
+    ).all()
+
+    expire_logs = [
+        {
+            "uuid": uuid.uuid4(),
+            "secret_id": secret.uuid,
+            "action": SecretLogActionEnum.EXPIRE,
+            "timestamp": datetime.now(timezone.utc),
+        }
+        for secret in expired
+        if not secret.used_up
+    ]
+    if expire_logs:
+        await maybe_await(db.execute(insert(SecretLogs.__table__), expire_logs))
+    await maybe_await(
+        db.execute(delete(Secret.__table__).filter(Secret.uuid.in_(secret_uuids)))
+    )
+    for content_model in (SecretTextContent, SecretFileContent, SecretContent):
+        await maybe_await(
+            db.execute(
+                delete(content_model.__table__).filter(
+                    content_model.uuid.in_(content_uuids)
+                )
+            )
+        )
+    await notify_count_change(db, -len(expired))
+    await maybe_await(db.commit())
+    secret_counter.add(-len(expired))
+
+    for secret_uuid in secret_uuids:
+        derived_key_cache.invalidate(secret_uuid)
+    for storage_key in storage_keys:
+        await blob_storage.delete_object(storage_key)
+    return len(expired)
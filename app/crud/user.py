@@ -1,36 +1,93 @@
-from sqlalchemy.orm import Session
+import os
+import uuid
+from typing import Optional
 
-from app.hash_manager import hash_password, verify_password
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from app.cache import TTLCache
+from app.database import AnySession, maybe_await, run_db
+from app.hash_manager import hashing_service
 from app.models.user import User
-from app.schemas.user import UserCreate
+from app.schemas.user import UserCreate, UserPrincipal
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
 
+# Principals of authenticated users keyed by the token "sub"
+user_cache = TTLCache("user", USER_CACHE_SIZE, USER_CACHE_TTL)
+# Session.info key of the users changed in the transaction, see collect_changed_user
+CHANGED_USERS = "changed_users"
 
-def create_user(db: Session, user: UserCreate) -> User:
-    hashed_password = hash_password(user.password)
+
+async def create_user(db: AnySession, user: UserCreate) -> User:
+    hashed_password = await hashing_service.hash_password(user.password)
     db_user = User(username=user.username, hashed_password=hashed_password)
     try:
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await run_db(db.commit)
+        await run_db(db.refresh, db_user)
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         return None
     return db_user
 
 
-def get_user_by_uuid(db: Session, user_uuid: str) -> User:
-    db_user = db.query(User).filter(User.uuid == user_uuid).first()
+async def get_user_by_uuid(db: AnySession, user_uuid: str) -> User:
+    db_user = await maybe_await(db.scalar(select(User).filter(User.uuid == user_uuid)))
     return db_user
 
 
-def get_user_by_username_password(db: Session, username: str, password: str) -> User:
-    db_user = (
-        db.query(User)
-        .filter(
+async def get_user_principal(db: AnySession, user_uuid: str) -> Optional[UserPrincipal]:
+    principal = user_cache.get(str(user_uuid))
+    if principal is None:
+        # The token "sub" is a string, an invalid one raises ValueError
+        db_user = await get_user_by_uuid(db, uuid.UUID(str(user_uuid)))
+        if db_user is None:
+            return None
+        principal = UserPrincipal.model_validate(db_user)
+        user_cache.set(str(user_uuid), principal)
+    return principal
+
+
+def invalidate_user_cache(user_uuid=None) -> None:
+    if user_uuid is None:
+        user_cache.clear()
+    else:
+        user_cache.pop(str(user_uuid))
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def collect_changed_user(mapper, connection, target: User) -> None:
+    # Only ORM flushes are seen here, bulk statements must invalidate explicitly
+    session = object_session(target)
+    session.info.setdefault(CHANGED_USERS, set()).add(str(target.uuid))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_users(session: Session) -> None:
+    # Not at flush: until the commit, a concurrent request would cache the old row again
+    for user_uuid in session.info.pop(CHANGED_USERS, ()):
+        invalidate_user_cache(user_uuid)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session: Session) -> None:
+    session.info.pop(CHANGED_USERS, None)
+
+
+async def get_user_by_username_password(
+    db: AnySession, username: str, password: str
+) -> User:
+    db_user = await run_db(
+        db.scalar,
+        select(User).filter(
             User.username == username,
-        )
-        .first()
+        ),
     )
-    if db_user is None or not verify_password(password, db_user.hashed_password):
+    if db_user is None or not await hashing_service.verify_password(
+        password, db_user.hashed_password
+    ):
         return None
     return db_user
@@ -1,17 +1,183 @@
-from cryptography.fernet import Fernet
 import base64
 import hashlib
+import os
+import struct
+from typing import AsyncIterable, AsyncIterator, Optional
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Binary envelope for small payloads: version byte, nonce, ciphertext and tag.
+ENVELOPE_VERSION = 1
+NONCE_SIZE = 12
+
+# Chunked format: header (version, segment size, nonce prefix) followed by
+# AES-256-GCM segments. Each segment nonce is the prefix, the segment index and
+# a last-segment flag, so segments cannot be reordered, dropped or truncated.
+STREAM_VERSION = 2
+SEGMENT_SIZE = 64 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+HEADER = struct.Struct(f">BI{NONCE_PREFIX_SIZE}s")
+
+
+def derive_key(password: str) -> bytes:
+    return hashlib.sha256(password.encode()).digest()
 
 
 def encrypt_text(text: bytes, password: str) -> bytes:
-    key = hashlib.sha256(password.encode()).digest()
-    fernet = Fernet(base64.urlsafe_b64encode(key))
-    encrypted_text = fernet.encrypt(text)
-    return encrypted_text
+    version = bytes([ENVELOPE_VERSION])
+    nonce = os.urandom(NONCE_SIZE)
+    return version + nonce + AESGCM(derive_key(password)).encrypt(nonce, text, version)
+
+
+def decrypt_text(
+    encrypted_text: bytes, password: str, aesgcm: Optional[AESGCM] = None
+) -> bytes:
+    """
+    aesgcm is the cipher of derive_key(password) when the caller already has
+    it, see app.key_cache.
+    """
+    if encrypted_text[:1] == bytes([ENVELOPE_VERSION]):
+        version = encrypted_text[:1]
+        nonce = encrypted_text[1 : 1 + NONCE_SIZE]
+        return (aesgcm or AESGCM(derive_key(password))).decrypt(
+            nonce, encrypted_text[1 + NONCE_SIZE :], version
+        )
+    if is_stream_encrypted(encrypted_text):
+        decryptor = StreamDecryptor(password, aesgcm)
+        return decryptor.update(encrypted_text) + decryptor.finalize()
+    return decrypt_fernet(encrypted_text, password)
+
+
+def decrypt_fernet(encrypted_text: bytes, password: str) -> bytes:
+    fernet = Fernet(base64.urlsafe_b64encode(derive_key(password)))
+    return fernet.decrypt(encrypted_text)
+
+
+def is_legacy_encrypted(data: bytes) -> bool:
+    # Legacy Fernet tokens are base64 and always start with "g"
+    return data[:1] not in (bytes([ENVELOPE_VERSION]), bytes([STREAM_VERSION]))
+
+
+def _segment_nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack(">I?", index, last)
+
+
+class StreamEncryptor:
+    def __init__(self, password: str, segment_size: int = SEGMENT_SIZE) -> None:
+        self.aesgcm = AESGCM(derive_key(password))
+        self.segment_size = segment_size
+        self.header = HEADER.pack(
+            STREAM_VERSION, segment_size, os.urandom(NONCE_PREFIX_SIZE)
+        )
+        self.prefix = self.header[-NONCE_PREFIX_SIZE:]
+        self.index = 0
+        self.buffer = bytearray()
+        self.started = False
+
+    def _seal(self, segment: bytes, last: bool) -> bytes:
+        nonce = _segment_nonce(self.prefix, self.index, last)
+        self.index += 1
+        return self.aesgcm.encrypt(nonce, segment, self.header)
+
+    def update(self, data: bytes) -> bytes:
+        output = bytearray()
+        if not self.started:
+            output += self.header
+            self.started = True
+        self.buffer += data
+        # Keep at least one byte back: only finalize() knows the last segment
+        while len(self.buffer) > self.segment_size:
+            output += self._seal(bytes(self.buffer[: self.segment_size]), False)
+            del self.buffer[: self.segment_size]
+        return bytes(output)
+
+    def finalize(self) -> bytes:
+        output = self.update(b"")
+        last = self._seal(bytes(self.buffer), True)
+        self.buffer.clear()
+        return output + last
+
+
+class StreamDecryptor:
+    def __init__(self, password: str, aesgcm: Optional[AESGCM] = None) -> None:
+        self.aesgcm = aesgcm or AESGCM(derive_key(password))
+        self.header = None
+        self.prefix = None
+        self.sealed_size = 0
+        self.index = 0
+        self.buffer = bytearray()
+
+    def _open(self, segment: bytes, last: bool) -> bytes:
+        nonce = _segment_nonce(self.prefix, self.index, last)
+        self.index += 1
+        return self.aesgcm.decrypt(nonce, segment, self.header)
+
+    def update(self, data: bytes) -> bytes:
+        self.buffer += data
+        if self.header is None:
+            if len(self.buffer) < HEADER.size:
+                return b""
+            self.header = bytes(self.buffer[: HEADER.size])
+            _, segment_size, self.prefix = HEADER.unpack(self.header)
+            self.sealed_size = segment_size + TAG_SIZE
+            del self.buffer[: HEADER.size]
+
+        output = bytearray()
+        while len(self.buffer) > self.sealed_size:
+            output += self._open(bytes(self.buffer[: self.sealed_size]), False)
+            del self.buffer[: self.sealed_size]
+        return bytes(output)
+
+    def finalize(self) -> bytes:
+        if self.header is None:
+            raise ValueError("Truncated encrypted stream")
+        output = self._open(bytes(self.buffer), True)
+        self.buffer.clear()
+        return output
+
+
+def is_stream_encrypted(data: bytes) -> bool:
+    return data[:1] == bytes([STREAM_VERSION])
+
+
+async def iter_chunks(
+    data: bytes, chunk_size: int = SEGMENT_SIZE
+) -> AsyncIterator[bytes]:
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start : start + chunk_size])
+
+
+async def encrypt_stream(
+    chunks: AsyncIterable[bytes], password: str
+) -> AsyncIterator[bytes]:
+    encryptor = StreamEncryptor(password)
+    async for chunk in chunks:
+        encrypted = encryptor.update(chunk)
+        if encrypted:
+            yield encrypted
+    yield encryptor.finalize()
+
 
+async def decrypt_stream(
+    chunks: AsyncIterable[bytes], password: str, aesgcm: Optional[AESGCM] = None
+) -> AsyncIterator[bytes]:
+    decryptor = None
+    legacy = bytearray()
+    async for chunk in chunks:
+        if decryptor is None and not legacy:
+            if is_stream_encrypted(chunk):
+                decryptor = StreamDecryptor(password, aesgcm)
+        if decryptor is None:
+            legacy += chunk
+            continue
+        decrypted = decryptor.update(chunk)
+        if decrypted:
+            yield decrypted
 
-def decrypt_text(encrypted_text: bytes, password: str) -> bytes:
-    key = hashlib.sha256(password.encode()).digest()
-    fernet = Fernet(base64.urlsafe_b64encode(key))
-    decrypted_text = fernet.decrypt(encrypted_text)
-    return decrypted_text
+    if decryptor is not None:
+        yield decryptor.finalize()
+    else:
+        yield decrypt_text(bytes(legacy), password)
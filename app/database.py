@@ -1,26 +1,170 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import inspect
 import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.migrations import migrate_schema
+from app.utils import (
+    DB_POOL_CHECKOUT_TIME,
+    DB_POOL_CONNECTIONS_IN_USE,
+    DB_POOL_OVERFLOW,
+)
 
 pg_password = os.environ.get("POSTGRES_PASSWORD")
 pg_user = os.environ.get("POSTGRES_USER")
 pg_ip = os.environ.get("POSTGRES_IP")
 pg_name = os.environ.get("POSTGRES_DB")
 
+# "psycopg2" (sync sessions) or "asyncpg" (async sessions)
+DATABASE_DRIVER = os.environ.get("DATABASE_DRIVER", "psycopg2")
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+
 SQLALCHEMY_DATABASE_URL = f"""postgresql://{pg_user}:{pg_password}@{pg_ip}/{pg_name}"""
+SQLALCHEMY_ASYNC_DATABASE_URL = (
+    f"""postgresql+asyncpg://{pg_user}:{pg_password}@{pg_ip}/{pg_name}"""
+)
+
+
+class MeteredPoolMixin:
+    """
+    Records the time Pool.connect() takes to hand out a connection, waiting
+    for a free one included.
+    """
+
+    driver: str
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_CHECKOUT_TIME.labels(driver=self.driver).observe(
+                time.perf_counter() - start
+            )
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    driver = "psycopg2"
+
+
+class MeteredAsyncQueuePool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    driver = "asyncpg"
+
+
+def instrument_pool(engine: Engine, driver: str) -> None:
+    """
+    Counts the connections in use and the overflow from the pool events.
+    Listening on the engine keeps the listeners on the pool that replaces
+    this one on dispose.
+    """
+    pool_size = engine.pool.size()
+    in_use = DB_POOL_CONNECTIONS_IN_USE.labels(driver=driver)
+    overflow = DB_POOL_OVERFLOW.labels(driver=driver)
+    opened = 0
+
+    def on_connect(dbapi_connection, connection_record):
+        nonlocal opened
+        opened += 1
+        overflow.set(max(opened - pool_size, 0))
+
+    # Detached connections leave the pool without being closed
+    def on_close(dbapi_connection, connection_record):
+        nonlocal opened
+        opened -= 1
+        overflow.set(max(opened - pool_size, 0))
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use.inc()
+
+    def on_checkin(dbapi_connection, connection_record):
+        in_use.dec()
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "close", on_close)
+    event.listen(engine, "detach", on_close)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+
+
+pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, poolclass=MeteredQueuePool, **pool_options
+)
+instrument_pool(engine, MeteredQueuePool.driver)
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=MeteredAsyncQueuePool, **pool_options
+)
+# Pool events are not available on AsyncEngine, only on its sync engine
+instrument_pool(async_engine.sync_engine, MeteredAsyncQueuePool.driver)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+AnySession = Session | AsyncSession
+
+
+async def maybe_await(result):
+    """
+    Lets crud functions run on both Session and AsyncSession: AsyncSession
+    methods return awaitables, Session methods return the result directly.
+    """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+async def run_db(method, *args, **kwargs):
+    """
+    Like maybe_await, without blocking the event loop on the sync driver:
+    Session methods run in the threadpool, one call at a time.
+    """
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    return await run_in_threadpool(method, *args, **kwargs)
+
+
+@asynccontextmanager
+async def open_session():
+    if DATABASE_DRIVER == "asyncpg":
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with open_session() as db:
         yield db
-    finally:
-        db.close()
 
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    migrate_schema(engine)
@@ -1,3 +1,95 @@
 import asyncio
+import logging
+import os
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
-secret_created_event = asyncio.Event()
+import asyncpg
+from sqlalchemy import func, select
+
+from app.database import AnySession, maybe_await
+
+SECRET_COUNT_CHANNEL = "secret_count"
+LISTEN_RETRY_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+
+class CountBroadcaster:
+    """
+    Keeps the secret count in memory and fans it out to SSE subscribers.
+    Changes made by other workers arrive through Postgres LISTEN/NOTIFY.
+    """
+
+    def __init__(self) -> None:
+        self.count: Optional[int] = None
+        self.subscribers: set[asyncio.Queue] = set()
+
+    def publish(self, count: int) -> None:
+        self.count = count
+        for queue in self.subscribers:
+            # Slow subscribers only need the latest value
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(count)
+
+    def add(self, delta: int) -> None:
+        if self.count is not None:
+            self.publish(self.count + delta)
+
+    async def subscribe(self) -> AsyncIterator[int]:
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        try:
+            if self.count is not None:
+                yield self.count
+            while True:
+                yield await queue.get()
+        finally:
+            self.subscribers.discard(queue)
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        sender, delta = payload.split(":")
+        if int(sender) != os.getpid():
+            self.add(int(delta))
+
+    async def run(
+        self, load_count: Callable[[], Awaitable[int]], dsn: Optional[str] = None
+    ) -> None:
+        if dsn is None:
+            self.publish(await load_count())
+            return
+
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.get_running_loop().create_future()
+                connection.add_termination_listener(
+                    lambda _: closed.done() or closed.set_result(None)
+                )
+                await connection.add_listener(
+                    SECRET_COUNT_CHANNEL, self._on_notification
+                )
+                # Notifications may have been missed while disconnected
+                self.publish(await load_count())
+                await closed
+            except asyncio.CancelledError:
+                if connection is not None:
+                    await connection.close()
+                raise
+            except Exception as e:
+                logger.error(f"Error listening to secret count changes: {e}")
+            await asyncio.sleep(LISTEN_RETRY_DELAY)
+
+
+async def notify_count_change(db: AnySession, delta: int) -> None:
+    # Sent in the caller's transaction, so other workers only see committed changes
+    if db.get_bind().dialect.name == "postgresql":
+        await maybe_await(
+            db.execute(
+                select(func.pg_notify(SECRET_COUNT_CHANNEL, f"{os.getpid()}:{delta}"))
+            )
+        )
+
+
+secret_counter = CountBroadcaster()
@@ -1,6 +1,19 @@
+import asyncio
 import hashlib
 import hmac
+import multiprocessing
 import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from app.crypting import encrypt_text
+from app.utils import HASH_PROCESSING_TIME, HASH_QUEUE_DEPTH, HASH_QUEUE_WAIT_TIME
+
+HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", 64))
 
 
 def hash_password(password: str) -> str:
@@ -16,3 +29,98 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         "sha256", plain_password.encode(), salt, 100000
     )
     return hmac.compare_digest(stored_password, new_hashed_password)
+
+
+def hash_and_encrypt(password: str, content: bytes) -> tuple[str, bytes]:
+    return hash_password(password), encrypt_text(content, password)
+
+
+def _timed_call(func, *args):
+    # time.monotonic is system wide, so it can be compared across processes
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic() - started
+
+
+class HashingSaturatedError(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": "1"},
+        )
+
+
+class HashingService:
+    """
+    Runs PBKDF2 hashing on a bounded worker pool so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        executor: str = HASH_EXECUTOR,
+        workers: int = HASH_WORKERS,
+        max_pending: int = HASH_MAX_PENDING,
+    ) -> None:
+        self.executor_type = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                # "spawn" like startServer.py: forking a process running
+                # threads (event loop, exporters) can deadlock the child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="hashing"
+                )
+        return self._executor
+
+    async def _submit(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            raise HashingSaturatedError()
+
+        self.pending += 1
+        HASH_QUEUE_DEPTH.inc()
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, elapsed = await loop.run_in_executor(
+                self._get_executor(), _timed_call, func, *args
+            )
+        finally:
+            self.pending -= 1
+            HASH_QUEUE_DEPTH.dec()
+
+        HASH_QUEUE_WAIT_TIME.labels(operation=operation).observe(started - submitted)
+        HASH_PROCESSING_TIME.labels(operation=operation).observe(elapsed)
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        return await self._submit("hash", hash_password, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(
+            "verify", verify_password, plain_password, hashed_password
+        )
+
+    async def hash_and_encrypt(
+        self, password: str, content: bytes
+    ) -> tuple[str, bytes]:
+        # One job for both, so a batch of secrets spreads over the workers
+        return await self._submit("hash_encrypt", hash_and_encrypt, password, content)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+hashing_service = HashingService()
@@ -0,0 +1,74 @@
+import hashlib
+import hmac
+import os
+from datetime import datetime
+from typing import Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.cache import TTLCache
+from app.crypting import derive_key
+
+DERIVED_KEY_CACHE_SIZE = int(os.environ.get("DERIVED_KEY_CACHE_SIZE", 1024))
+DERIVED_KEY_CACHE_TTL = float(os.environ.get("DERIVED_KEY_CACHE_TTL", 60))
+
+
+class DerivedKey:
+    def __init__(self, password_mac: bytes, password: str) -> None:
+        self.password_mac = password_mac
+        self.key = bytearray(derive_key(password))
+        self.aesgcm = AESGCM(self.key)
+
+    def zeroize(self) -> None:
+        # Best effort: the copy held by the cipher backend is out of reach
+        self.key[:] = bytes(len(self.key))
+        self.aesgcm = None
+
+
+class DerivedKeyCache:
+    """
+    Remembers, for a short time, that a password was verified for a secret
+    that has uses left, with the cipher of its derived key. Further reads with
+    the same password then skip PBKDF2 verification and key derivation.
+    Passwords are only kept as an HMAC under a per-process random key.
+    """
+
+    def __init__(
+        self, maxsize: int = DERIVED_KEY_CACHE_SIZE, ttl: float = DERIVED_KEY_CACHE_TTL
+    ) -> None:
+        self.mac_key = os.urandom(32)
+        self.keys = TTLCache(
+            "derived_key", maxsize, ttl, on_evict=lambda entry: entry.zeroize()
+        )
+
+    def _mac(self, password: str) -> bytes:
+        return hmac.new(self.mac_key, password.encode(), hashlib.sha256).digest()
+
+    def _match(self, entry: Optional[DerivedKey], password: str) -> Optional[AESGCM]:
+        if entry is None or not hmac.compare_digest(
+            entry.password_mac, self._mac(password)
+        ):
+            return None
+        return entry.aesgcm
+
+    def verify(self, secret_uuid, password: str) -> bool:
+        return self._match(self.keys.get(str(secret_uuid)), password) is not None
+
+    def cipher(self, secret_uuid, password: str) -> Optional[AESGCM]:
+        return self._match(self.keys.peek(str(secret_uuid)), password)
+
+    def put(
+        self, secret_uuid, password: str, destruction: Optional[datetime] = None
+    ) -> AESGCM:
+        entry = DerivedKey(self._mac(password), password)
+        ttl = None
+        if destruction is not None:
+            ttl = (destruction - datetime.now()).total_seconds()
+        self.keys.set(str(secret_uuid), entry, ttl)
+        return entry.aesgcm
+
+    def invalidate(self, secret_uuid) -> None:
+        self.keys.pop(str(secret_uuid))
+
+
+derived_key_cache = DerivedKeyCache()
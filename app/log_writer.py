@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from app.database import maybe_await, open_session
+from app.models.secretLogs import SecretLogs
+from app.utils import AUDIT_LOG_DROPPED, AUDIT_LOG_FLUSH_TIME, AUDIT_LOG_PENDING
+
+# "sync" writes audit logs in the transaction of the operation they record,
+# "buffered" hands them to SecretLogWriter and commits them in batches
+AUDIT_LOG_MODE = os.environ.get("AUDIT_LOG_MODE", "sync")
+AUDIT_LOG_BATCH_SIZE = int(os.environ.get("AUDIT_LOG_BATCH_SIZE", 500))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", 1))
+AUDIT_LOG_MAX_PENDING = int(os.environ.get("AUDIT_LOG_MAX_PENDING", 10000))
+# Wait before the single retry of a failed batch
+AUDIT_LOG_RETRY_DELAY = float(os.environ.get("AUDIT_LOG_RETRY_DELAY", 1))
+
+logger = logging.getLogger(__name__)
+
+
+class SecretLogWriter:
+    """
+    Buffers audit logs in memory and inserts them with one multi-row INSERT
+    per batch, every flush_interval seconds or as soon as batch_size logs are
+    pending. A failed batch is retried once, then dropped and counted in
+    AUDIT_LOG_DROPPED. Logs still pending when the process dies are lost.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = AUDIT_LOG_BATCH_SIZE,
+        flush_interval: float = AUDIT_LOG_FLUSH_INTERVAL,
+        max_pending: int = AUDIT_LOG_MAX_PENDING,
+        retry_delay: float = AUDIT_LOG_RETRY_DELAY,
+        session_opener=open_session,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.session_opener = session_opener
+        self.pending: list[dict] = []
+        self.batch_ready = asyncio.Event()
+        self.task = None
+
+    async def enqueue(self, secret_uuid, action) -> None:
+        self.pending.append(
+            {
+                "uuid": uuid.uuid4(),
+                "secret_id": secret_uuid,
+                "action": action,
+                "timestamp": datetime.now(timezone.utc),
+            }
+        )
+        AUDIT_LOG_PENDING.set(len(self.pending))
+        if len(self.pending) >= self.max_pending:
+            # Back pressure: the caller waits for the backlog to be written
+            await self.flush()
+        elif len(self.pending) >= self.batch_size:
+            self.batch_ready.set()
+
+    async def flush(self) -> None:
+        while self.pending:
+            rows = self.pending[: self.batch_size]
+            del self.pending[: self.batch_size]
+            AUDIT_LOG_PENDING.set(len(self.pending))
+            start = time.perf_counter()
+            try:
+                await self.write_batch(rows)
+            except asyncio.CancelledError:
+                self.pending[:0] = rows
+                AUDIT_LOG_PENDING.set(len(self.pending))
+                raise
+            finally:
+                AUDIT_LOG_FLUSH_TIME.observe(time.perf_counter() - start)
+
+    async def write_batch(self, rows: list[dict]) -> None:
+        try:
+            await self.insert(rows)
+            return
+        except Exception as e:
+            logger.warning(f"Error writing {len(rows)} secret logs, retrying: {e}")
+        await asyncio.sleep(self.retry_delay)
+        try:
+            await self.insert(rows)
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} secret logs, dropped: {e}")
+            AUDIT_LOG_DROPPED.inc(len(rows))
+
+    async def insert(self, rows: list[dict]) -> None:
+        async with self.session_opener() as db:
+            await maybe_await(db.execute(insert(SecretLogs.__table__), rows))
+            await maybe_await(db.commit())
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Drain what is left before the process exits
+        await self.flush()
+
+
+secret_log_writer = SecretLogWriter()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Coroutine, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.utils import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG, RouteIndex
+
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", 0.25))
+# Debug mode: a watchdog thread logs the stack of the event loop thread and
+# the route being served whenever the loop is blocked for LOOP_BLOCK_THRESHOLD
+LOOP_MONITOR_DEBUG = os.environ.get("LOOP_MONITOR_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", 0.1))
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    Measures how late a sleep wakes up on the event loop: any callback that
+    runs without awaiting (ORM calls, PBKDF2, decryption) delays it.
+    """
+
+    def __init__(
+        self,
+        interval: float = LOOP_MONITOR_INTERVAL,
+        debug: bool = LOOP_MONITOR_DEBUG,
+        block_threshold: float = LOOP_BLOCK_THRESHOLD,
+    ) -> None:
+        self.interval = interval
+        self.debug = debug
+        self.block_threshold = block_threshold
+        # Task name and route template of the request step each loop is
+        # running, written by the loop thread, see LoopMonitorMiddleware
+        self.current: dict[asyncio.AbstractEventLoop, tuple[str, str]] = {}
+        self.last_beat = time.monotonic()
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(loop.time() - start - self.interval, 0))
+
+    def beat(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.last_beat = time.monotonic()
+        if not self.stopped.is_set():
+            loop.call_later(self.block_threshold / 2, self.beat, loop)
+
+    def watch(self, loop: asyncio.AbstractEventLoop, thread_id: int) -> None:
+        reported_beat = None
+        while not self.stopped.wait(self.block_threshold / 2):
+            last_beat = self.last_beat
+            blocked = time.monotonic() - last_beat
+            # Once per block
+            if blocked < self.block_threshold or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+            self.report(loop, thread_id, blocked)
+
+    def report(
+        self, loop: asyncio.AbstractEventLoop, thread_id: int, blocked: float
+    ) -> None:
+        # Written by the loop thread before it got stuck in the step
+        task_name, path = self.current.get(loop, (None, "unknown"))
+        frame = sys._current_frames().get(thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        EVENT_LOOP_BLOCKS.labels(path=path).inc()
+        logger.warning(
+            f"Event loop blocked for {blocked:.3f}s serving {path}, "
+            f"task {task_name}:\n{stack}"
+        )
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self.run())
+        if self.debug:
+            self.beat(loop)
+            self.watchdog = threading.Thread(
+                target=self.watch,
+                args=(loop, threading.get_ident()),
+                name="loop-watchdog",
+                daemon=True,
+            )
+            self.watchdog.start()
+
+    async def stop(self) -> None:
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+
+
+class RequestSteps:
+    """
+    Awaits a request coroutine one step at a time, recording the request in
+    current while each step runs on the loop.
+    """
+
+    def __init__(
+        self,
+        coro: Coroutine,
+        current: dict[asyncio.AbstractEventLoop, tuple[str, str]],
+        request: tuple[str, str],
+    ) -> None:
+        self.coro = coro
+        self.current = current
+        self.request = request
+
+    def __await__(self):
+        loop = asyncio.get_running_loop()
+        value, error = None, None
+        while True:
+            self.current[loop] = self.request
+            try:
+                if error is None:
+                    future = self.coro.send(value)
+                else:
+                    future = self.coro.throw(error)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.current.pop(loop, None)
+            try:
+                value, error = (yield future), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                # Cancellation included
+                value, error = None, e
+
+
+class LoopMonitorMiddleware:
+    """
+    Records the route template of the request step the loop is running, so
+    the watchdog can attribute a block to a route. Only added in debug mode.
+    """
+
+    def __init__(self, app: ASGIApp, monitor: Optional[LoopMonitor] = None) -> None:
+        self.app = app
+        self.monitor = monitor or loop_monitor
+        self.route_index = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.route_index is None:
+            self.route_index = RouteIndex(scope["app"].routes)
+        path = self.route_index.get_path(scope)
+        if path is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = (asyncio.current_task().get_name(), path)
+        await RequestSteps(
+            self.app(scope, receive, send), self.monitor.current, request
+        )
+
+
+loop_monitor = LoopMonitor()
@@ -1,13 +1,21 @@
+import asyncio
 import logging
 import os
 
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 
-from app.database import create_tables
+from app.crud.secrets import count_secrets
+from app.database import SQLALCHEMY_DATABASE_URL, create_tables, open_session
+from app.events import secret_counter
+from app.hash_manager import hashing_service
+from app.log_writer import AUDIT_LOG_MODE, secret_log_writer
+from app.loop_monitor import LOOP_MONITOR_DEBUG, LoopMonitorMiddleware, loop_monitor
+from app.partitions import manage_partitions, run_partition_manager
 from app.routers.auth import auth_router
 from app.routers.secret import secrets_router
 from app.routers.secretLogs import secrets_log_router
+from app.sweeper import SWEEPER_ENABLED, run_sweeper
 from app.utils import PrometheusMiddleware, metrics, setting_otlp
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -29,7 +37,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],  # Expose the Content-Disposition header
+    # Expose the Content-Disposition and pagination headers
+    expose_headers=["Content-Disposition", "X-Next-Cursor"],
 )
 
 OTLP_GRPC_ENDPOINT = os.environ.get("OTLP_GRPC_ENDPOINT", "http://tempo:4317")
@@ -50,6 +59,10 @@ logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
 app.add_middleware(PrometheusMiddleware, app_name=APP_NAME)
 app.add_route("/metrics", metrics)
 
+# Attributes event loop blocks to routes, only needed by the debug watchdog
+if LOOP_MONITOR_DEBUG:
+    app.add_middleware(LoopMonitorMiddleware)
+
 # Setting OpenTelemetry exporter
 setting_otlp(app, APP_NAME, OTLP_GRPC_ENDPOINT)
 
@@ -58,9 +71,38 @@ app.include_router(secrets_router)
 app.include_router(secrets_log_router)
 
 
+async def load_secret_count():
+    async with open_session() as db:
+        return await count_secrets(db)
+
+
 @app.on_event("startup")
 async def onStartup():
+    loop_monitor.start()
     create_tables()
+    async with open_session() as db:
+        # Log inserts fail until the partition of the current month exists
+        await manage_partitions(db)
+    app.state.partition_manager = asyncio.create_task(run_partition_manager())
+    app.state.secret_counter = asyncio.create_task(
+        secret_counter.run(load_secret_count, SQLALCHEMY_DATABASE_URL)
+    )
+    if SWEEPER_ENABLED:
+        app.state.sweeper = asyncio.create_task(run_sweeper())
+    if AUDIT_LOG_MODE == "buffered":
+        secret_log_writer.start()
+
+
+@app.on_event("shutdown")
+async def onShutdown():
+    app.state.partition_manager.cancel()
+    app.state.secret_counter.cancel()
+    if SWEEPER_ENABLED:
+        app.state.sweeper.cancel()
+    if AUDIT_LOG_MODE == "buffered":
+        await secret_log_writer.stop()
+    hashing_service.shutdown()
+    await loop_monitor.stop()
 
 
 @app.get("/", include_in_schema=False)
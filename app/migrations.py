@@ -0,0 +1,72 @@
+import logging
+
+from sqlalchemy import Connection, Engine, func, select, text
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key shared by every worker for pg_advisory_lock
+MIGRATION_LOCK_ID = 0x5EC3A7
+
+# Brings a database created by an older version up to the models, which
+# create_all does not do for existing tables. Every statement is idempotent:
+# they all run on each startup
+SCHEMA_MIGRATIONS = [
+    # File payloads moved to the blob storage keep only their key and size
+    "ALTER TABLE secret_file_content ADD COLUMN IF NOT EXISTS storage_key VARCHAR",
+    "ALTER TABLE secret_file_content ADD COLUMN IF NOT EXISTS size BIGINT",
+    "ALTER TABLE secret_file_content ALTER COLUMN content DROP NOT NULL",
+    # The audit log outlives purged secrets, the sweeper deletes them anyway
+    'ALTER TABLE "secretLogs" DROP CONSTRAINT IF EXISTS "secretLogs_secret_id_fkey"',
+    # The sweeper finds used up secrets by destruction, which read_secret now
+    # sets on the last use
+    "UPDATE secret SET destruction = LOCALTIMESTAMP "
+    "WHERE usage_count >= usage_limit "
+    "AND (destruction IS NULL OR destruction > LOCALTIMESTAMP)",
+]
+
+# Indexes of tables that predate them: (table, index, columns). The indexes
+# of secretLogs are made with the partitioned table, see app/partitions.py
+INDEX_MIGRATIONS = [
+    ("secret", "ix_secret_creation_uuid", "creation, uuid"),
+    ("secret", "ix_secret_user_uuid_creation_uuid", "user_uuid, creation, uuid"),
+]
+
+
+def create_index_sql(table: str, name: str, columns: str) -> str:
+    return f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({columns})'
+
+
+def create_indexes(connection: Connection) -> None:
+    """
+    Builds the missing indexes without blocking writes to large tables.
+    """
+    for table, name, columns in INDEX_MIGRATIONS:
+        valid = connection.scalar(
+            text(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+            ),
+            {"name": f'"{name}"'},
+        )
+        if valid is False:
+            # Left by an interrupted concurrent build, IF NOT EXISTS would keep it
+            connection.execute(text(f'DROP INDEX CONCURRENTLY "{name}"'))
+        connection.execute(text(create_index_sql(table, name, columns)))
+
+
+def migrate_schema(engine: Engine, migrations: list[str] = SCHEMA_MIGRATIONS) -> None:
+    """
+    Runs the schema migrations on Postgres, one worker at a time.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect() as connection:
+        # CREATE INDEX CONCURRENTLY cannot run in a transaction
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute(select(func.pg_advisory_lock(MIGRATION_LOCK_ID)))
+        try:
+            for statement in migrations:
+                connection.execute(text(statement))
+            create_indexes(connection)
+        finally:
+            connection.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK_ID)))
+    logger.info(f"Ran {len(migrations)} schema migrations")
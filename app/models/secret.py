@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import UUID, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import UUID, Column, ForeignKey, Index, Integer, String, DateTime
 from app.database import Base
 from sqlalchemy.orm import relationship
 
@@ -15,11 +15,26 @@ class Secret(Base):
     hashed_password = Column(String, index=True, nullable=False)
 
     user_uuid = Column(UUID(as_uuid=True), ForeignKey("user.uuid"), nullable=True)
-    user = relationship("User", back_populates="secrets")
+    user = relationship("User", back_populates="secrets", lazy="raise")
 
     content_id = Column(
         UUID(as_uuid=True), ForeignKey("secret_content.uuid"), nullable=True
     )
 
-    content = relationship("SecretContent", uselist=False, back_populates="secret")
-    logs = relationship("SecretLogs", back_populates="secret")
+    # lazy="raise": relationships are only loaded by explicit loader options,
+    # so no query path pulls a payload by accident
+    content = relationship(
+        "SecretContent", uselist=False, back_populates="secret", lazy="raise"
+    )
+    logs = relationship(
+        "SecretLogs",
+        back_populates="secret",
+        primaryjoin="Secret.uuid == foreign(SecretLogs.secret_id)",
+        lazy="raise",
+    )
+
+    # Keyset pagination of all secrets and of a user's secrets
+    __table_args__ = (
+        Index("ix_secret_creation_uuid", "creation", "uuid"),
+        Index("ix_secret_user_uuid_creation_uuid", "user_uuid", "creation", "uuid"),
+    )
@@ -9,6 +9,8 @@ class SecretContent(Base):
 
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     type = Column(String, nullable=False)
-    secret = relationship("Secret", uselist=False, back_populates="content")
+    secret = relationship(
+        "Secret", uselist=False, back_populates="content", lazy="raise"
+    )
 
     __mapper_args__ = {"polymorphic_identity": "secret_content", "polymorphic_on": type}
@@ -1,4 +1,5 @@
-from sqlalchemy import UUID, Column, ForeignKey, String, LargeBinary
+from sqlalchemy import UUID, BigInteger, Column, ForeignKey, String, LargeBinary
+from sqlalchemy.orm import deferred
 from app.models.secretContent import SecretContent
 
 
@@ -8,7 +9,11 @@ class SecretFileContent(SecretContent):
     uuid = Column(
         UUID(as_uuid=True), ForeignKey("secret_content.uuid"), primary_key=True
     )
-    content = Column(LargeBinary, nullable=False)
+    # Inline ciphertext, or None when the payload lives in the blob storage.
+    # Deferred: only loaded by the queries that decrypt it, other access raises
+    content = deferred(Column(LargeBinary, nullable=True), raiseload=True)
+    storage_key = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=True)
     filename = Column(String, nullable=True)
 
     __mapper_args__ = {"polymorphic_identity": "file"}
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import UUID, Column, Enum, ForeignKey, DateTime, func
+from sqlalchemy import UUID, Column, Enum, DateTime, Index, func
 from app.database import Base
 from sqlalchemy.orm import relationship
 
@@ -11,7 +11,29 @@ class SecretLogs(Base):
 
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     action = Column(Enum(SecretLogActionEnum), nullable=False)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Part of the primary key: Postgres requires the partition key in it
+    timestamp = Column(
+        DateTime(timezone=True),
+        primary_key=True,
+        nullable=False,
+        server_default=func.now(),
+    )
 
-    secret_id = Column(UUID(as_uuid=True), ForeignKey("secret.uuid"), nullable=False)
-    secret = relationship("Secret", back_populates="logs")
+    # No database foreign key: the audit log outlives purged secrets
+    secret_id = Column(UUID(as_uuid=True), nullable=False)
+    secret = relationship(
+        "Secret",
+        back_populates="logs",
+        primaryjoin="foreign(SecretLogs.secret_id) == Secret.uuid",
+        lazy="raise",
+    )
+
+    # Keyset pagination of all logs and of the logs of a secret. On Postgres
+    # the table is partitioned by month, see app/partitions.py
+    __table_args__ = (
+        Index("ix_secretLogs_timestamp_uuid", "timestamp", "uuid"),
+        Index(
+            "ix_secretLogs_secret_id_timestamp_uuid", "secret_id", "timestamp", "uuid"
+        ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
@@ -1,4 +1,5 @@
 from sqlalchemy import UUID, Column, ForeignKey, LargeBinary
+from sqlalchemy.orm import deferred
 from app.models.secretContent import SecretContent
 
 
@@ -8,6 +9,7 @@ class SecretTextContent(SecretContent):
     uuid = Column(
         UUID(as_uuid=True), ForeignKey("secret_content.uuid"), primary_key=True
     )
-    content = Column(LargeBinary, nullable=False)
+    # Deferred: only loaded by the queries that decrypt it, other access raises
+    content = deferred(Column(LargeBinary, nullable=False), raiseload=True)
 
     __mapper_args__ = {"polymorphic_identity": "text"}
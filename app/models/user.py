@@ -11,4 +11,4 @@ class User(Base):
     username = Column(String, nullable=False, unique=True, index=True)
     hashed_password = Column(String, nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
-    secrets = relationship("Secret", back_populates="user")
+    secrets = relationship("Secret", back_populates="user", lazy="raise")
@@ -0,0 +1,52 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import Select, tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(position: datetime, row_uuid: uuid.UUID) -> str:
+    payload = json.dumps([position.isoformat(), str(row_uuid)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        position, row_uuid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position), uuid.UUID(row_uuid)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def paginate(
+    query: Select,
+    position_column,
+    uuid_column,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+) -> Select:
+    """
+    Orders by (position, uuid) so pages are stable. With a cursor the query
+    seeks past the last row of the previous page through the composite index
+    instead of scanning the skipped rows.
+    """
+    if cursor is not None:
+        query = query.filter(
+            tuple_(position_column, uuid_column) > tuple_(*decode_cursor(cursor))
+        )
+    return query.order_by(position_column, uuid_column).offset(skip).limit(limit)
+
+
+def set_next_cursor(response: Response, rows: list, position_attr: str, limit: int):
+    # A short page is the last one
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            getattr(last, position_attr), last.uuid
+        )
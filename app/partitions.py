@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.database import AnySession, maybe_await, open_session
+from app.models.secretLogs import SecretLogs
+
+AUDIT_LOG_PARTITIONS_AHEAD = int(os.environ.get("AUDIT_LOG_PARTITIONS_AHEAD", 3))
+# 0 keeps every partition
+AUDIT_LOG_RETENTION_MONTHS = int(os.environ.get("AUDIT_LOG_RETENTION_MONTHS", 0))
+PARTITION_MANAGER_INTERVAL = float(os.environ.get("PARTITION_MANAGER_INTERVAL", 3600))
+# Arbitrary key shared by every worker for pg_advisory_xact_lock
+PARTITION_LOCK_ID = 0x5EC106
+
+PARENT_TABLE = SecretLogs.__tablename__
+PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$")
+# Takes the rows no monthly partition covers (a clock far off, a partition
+# manager that stopped), instead of failing the audit INSERT. Never dropped
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+# Plain secretLogs of a database created before partitioning, while converted
+LEGACY_TABLE = f"{PARENT_TABLE}_legacy"
+
+logger = logging.getLogger(__name__)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+async def is_partitioned(db: AnySession) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return await maybe_await(
+        db.scalar(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass(:parent))"
+            ),
+            {"parent": f'"{PARENT_TABLE}"'},
+        )
+    )
+
+
+async def list_partitions(db: AnySession) -> list[str]:
+    result = await maybe_await(
+        db.scalars(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:parent)"
+            ),
+            {"parent": f'"{PARENT_TABLE}"'},
+        )
+    )
+    return result.all()
+
+
+def plan_partitions(
+    today: date,
+    existing: Iterable[str],
+    months_ahead: int = AUDIT_LOG_PARTITIONS_AHEAD,
+    retention_months: int = AUDIT_LOG_RETENTION_MONTHS,
+    first_month: Optional[date] = None,
+) -> tuple[list[date], list[str]]:
+    """
+    Returns the months from the current one, or the earlier first_month, to
+    months_ahead that have no partition yet, and the partitions entirely
+    older than retention_months.
+    """
+    current = date(today.year, today.month, 1)
+    start = min(
+        current,
+        date(first_month.year, first_month.month, 1) if first_month else current,
+    )
+    existing = set(existing)
+    months = []
+    month = start
+    while month <= add_months(current, months_ahead):
+        if partition_name(month) not in existing:
+            months.append(month)
+        month = add_months(month, 1)
+
+    expired = []
+    if retention_months > 0:
+        cutoff = add_months(current, -retention_months)
+        for name in sorted(existing):
+            match = PARTITION_NAME.match(name)
+            if match is None:
+                continue
+            month = date(int(match[1]), int(match[2]), 1)
+            if add_months(month, 1) <= cutoff:
+                expired.append(name)
+    return months, expired
+
+
+def in_month_sql(month: date) -> str:
+    return (
+        f"\"timestamp\" >= '{month.isoformat()} 00:00+00' "
+        f"AND \"timestamp\" < '{add_months(month, 1).isoformat()} 00:00+00'"
+    )
+
+
+def create_partition_sql(month: date) -> str:
+    return (
+        f'CREATE TABLE "{partition_name(month)}" PARTITION OF "{PARENT_TABLE}" '
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') "
+        f"TO ('{add_months(month, 1).isoformat()} 00:00+00')"
+    )
+
+
+def reclaim_default_rows_sql(month: date) -> list[str]:
+    """
+    Creating a partition fails while the default partition holds rows of its
+    range: detach the default, create the partition and move the rows to it.
+    """
+    in_month = in_month_sql(month)
+    return [
+        f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"',
+        create_partition_sql(month),
+        f'INSERT INTO "{PARENT_TABLE}" SELECT * FROM "{DEFAULT_PARTITION}" '
+        f"WHERE {in_month}",
+        f'DELETE FROM "{DEFAULT_PARTITION}" WHERE {in_month}',
+        f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT',
+    ]
+
+
+def create_default_partition_sql() -> str:
+    return f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" DEFAULT'
+
+
+def drop_partition_sql(name: str) -> str:
+    return f'DROP TABLE "{name}"'
+
+
+def rename_legacy_table_sql() -> list[str]:
+    return [
+        f'ALTER TABLE "{PARENT_TABLE}" RENAME TO "{LEGACY_TABLE}"',
+        f'ALTER INDEX IF EXISTS "{PARENT_TABLE}_pkey" RENAME TO "{LEGACY_TABLE}_pkey"',
+        # Their names belong to the indexes of the partitioned table
+        *(
+            f'DROP INDEX IF EXISTS "{index.name}"'
+            for index in sorted(SecretLogs.__table__.indexes, key=lambda i: i.name)
+        ),
+    ]
+
+
+def copy_legacy_rows_sql() -> str:
+    # Rows without a timestamp end up in the default partition
+    return (
+        f'INSERT INTO "{PARENT_TABLE}" (uuid, action, "timestamp", secret_id) '
+        f"SELECT uuid, action, COALESCE(\"timestamp\", 'epoch'), secret_id "
+        f'FROM "{LEGACY_TABLE}"'
+    )
+
+
+async def convert_legacy_table(db: AnySession) -> Optional[date]:
+    """
+    Renames a plain secretLogs out of the way and creates the partitioned
+    one in its place. Returns the month of its oldest log, whose partitions
+    must exist before the rows are copied.
+    """
+    for statement in rename_legacy_table_sql():
+        await maybe_await(db.execute(text(statement)))
+    await maybe_await(db.execute(CreateTable(SecretLogs.__table__)))
+    for index in SecretLogs.__table__.indexes:
+        await maybe_await(db.execute(CreateIndex(index)))
+    oldest = await maybe_await(
+        db.scalar(text(f'SELECT min("timestamp") FROM "{LEGACY_TABLE}"'))
+    )
+    return oldest.date() if oldest is not None else None
+
+
+async def manage_partitions(
+    db: AnySession,
+    months_ahead: int = AUDIT_LOG_PARTITIONS_AHEAD,
+    retention_months: int = AUDIT_LOG_RETENTION_MONTHS,
+) -> tuple[list[str], list[str]]:
+    """
+    Creates the monthly partitions of secretLogs from the current month to
+    months_ahead, and drops the ones entirely older than retention_months.
+    A plain secretLogs left by an older version is converted first, in the
+    same transaction. Returns the created and dropped partition names.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return [], []
+    await maybe_await(db.execute(select(func.pg_advisory_xact_lock(PARTITION_LOCK_ID))))
+
+    first_month = None
+    converting = not await is_partitioned(db)
+    if converting:
+        logger.warning(f"Converting {PARENT_TABLE} to a partitioned table")
+        first_month = await convert_legacy_table(db)
+    existing = await list_partitions(db)
+    months, expired = plan_partitions(
+        datetime.now(timezone.utc).date(),
+        existing,
+        months_ahead,
+        retention_months,
+        first_month,
+    )
+    created = []
+    if DEFAULT_PARTITION not in existing:
+        await maybe_await(db.execute(text(create_default_partition_sql())))
+        created.append(DEFAULT_PARTITION)
+    for month in months:
+        in_default = await maybe_await(
+            db.scalar(
+                text(
+                    f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" '
+                    f"WHERE {in_month_sql(month)})"
+                )
+            )
+        )
+        statements = (
+            reclaim_default_rows_sql(month)
+            if in_default
+            else [create_partition_sql(month)]
+        )
+        for statement in statements:
+            await maybe_await(db.execute(text(statement)))
+        created.append(partition_name(month))
+    for name in expired:
+        await maybe_await(db.execute(text(drop_partition_sql(name))))
+    if converting:
+        copied = await maybe_await(db.execute(text(copy_legacy_rows_sql())))
+        await maybe_await(db.execute(text(f'DROP TABLE "{LEGACY_TABLE}"')))
+        logger.warning(
+            f"Copied {copied.rowcount} logs to the partitioned {PARENT_TABLE}"
+        )
+
+    await maybe_await(db.commit())
+    return created, expired
+
+
+async def run_partition_manager(
+    interval: float = PARTITION_MANAGER_INTERVAL,
+) -> None:
+    while True:
+        try:
+            async with open_session() as db:
+                created, dropped = await manage_partitions(db)
+            if created or dropped:
+                logger.info(
+                    f"Created log partitions {created}, dropped log partitions {dropped}"
+                )
+        except Exception as e:
+            logger.error(f"Error managing log partitions: {e}")
+        await asyncio.sleep(interval)
+
+
+async def manage_partitions_once() -> None:
+    async with open_session() as db:
+        created, dropped = await manage_partitions(db)
+    print(f"Created log partitions {created}, dropped log partitions {dropped}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage secretLogs partitions")
+    parser.add_argument(
+        "--loop",
+        action="store_true",
+        help="Keep managing partitions every PARTITION_MANAGER_INTERVAL",
+    )
+    args = parser.parse_args()
+    asyncio.run(run_partition_manager() if args.loop else manage_partitions_once())
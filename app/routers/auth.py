@@ -3,11 +3,10 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 
 from app.access_token_manager import create_access_token
 from app.crud.user import create_user, get_user_by_username_password
-from app.database import get_db
+from app.database import AnySession, get_db
 from app.schemas.user import User, UserCreate
 
 auth_router = APIRouter(
@@ -26,14 +25,17 @@ logger = logging.getLogger(__name__)
     responses={
         409: {"description": "Username already exists"},
         500: {"description": "Internal Server Error"},
+        503: {"description": "Server is busy, please retry later"},
     },
 )
-def register(
+async def register(
     auth: Annotated[UserCreate, Depends()],
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
 ) -> User:
     try:
-        user = create_user(db, auth)
+        user = await create_user(db, auth)
+    except HTTPException as e:
+        raise e
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -54,14 +56,15 @@ def register(
     responses={
         401: {"description": "Invalid credentials"},
         500: {"description": "Internal Server Error"},
+        503: {"description": "Server is busy, please retry later"},
     },
 )
-def login(
+async def login(
     auth: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
 ):
     try:
-        user = get_user_by_username_password(db, auth.username, auth.password)
+        user = await get_user_by_username_password(db, auth.username, auth.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
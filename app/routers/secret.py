@@ -1,45 +1,60 @@
 import logging
-from io import BytesIO
-from typing import Optional
+import os
+import uuid
+from typing import Any, AsyncIterator, Optional
 
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
+    Body,
     Depends,
     File,
     Form,
     HTTPException,
     Path,
     Query,
+    Response,
     UploadFile,
     status,
 )
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, StreamingResponse
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
 from sse_starlette import EventSourceResponse
 
 from app.auth_user import get_current_user
 from app.crud.secrets import (
-    count_secrets,
+    content_needs_migration,
     create_secret_from_file,
     create_secret_from_text,
+    create_secrets_from_text,
+    iter_file_content,
+    migrate_legacy_content,
     read_secret,
     read_secret_type,
     read_user_secrets,
 )
-from app.crypting import decrypt_text
-from app.database import get_db
-from app.events import secret_created_event
-from app.models.user import User
+from app.crypting import SEGMENT_SIZE, decrypt_stream, decrypt_text
+from app.database import AnySession, get_db, open_session
+from app.events import secret_counter
+from app.key_cache import derived_key_cache
+from app.pagination import set_next_cursor
+from app.utils import phase, phase_chunks
 from app.schemas.secret import (
     DecryptedSecret,
     Secret,
+    SecretBatchResult,
+    SecretBatchText,
     SecretCreateFile,
     SecretCreateText,
     SecretType,
 )
+from app.schemas.user import UserPrincipal
 
 SECRET_PREFIX = "/secrets"
+SECRET_FILE_MAX_SIZE_MB = int(os.environ.get("SECRET_FILE_MAX_SIZE_MB", 5))
+SECRET_FILE_MAX_SIZE = SECRET_FILE_MAX_SIZE_MB * 1024 * 1024
+SECRET_BATCH_MAX_SIZE = int(os.environ.get("SECRET_BATCH_MAX_SIZE", 500))
 secrets_router = APIRouter(
     prefix=SECRET_PREFIX,
     tags=["Secrets"],
@@ -49,6 +64,26 @@ secrets_router = APIRouter(
 logger = logging.getLogger(__name__)
 
 
+async def read_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    size = 0
+    while chunk := await file.read(SEGMENT_SIZE):
+        size += len(chunk)
+        if size > SECRET_FILE_MAX_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size exceeds the {SECRET_FILE_MAX_SIZE_MB}MB limit",
+            )
+        yield chunk
+
+
+async def migrate_legacy_secret(secret_uuid, password: str):
+    try:
+        async with open_session() as db:
+            await migrate_legacy_content(db, secret_uuid, password)
+    except Exception as e:
+        logger.error(f"Error migrating secret content: {e}")
+
+
 @secrets_router.post(
     "/file",
     response_model=Secret,
@@ -57,14 +92,18 @@ logger = logging.getLogger(__name__)
     response_description="The details of the uploaded secret file",
     responses={
         401: {"description": "Not authenticated"},
-        413: {"description": "File size exceeds the 5MB limit"},
+        413: {"description": "File size exceeds the size limit"},
         500: {"description": "Internal Server Error"},
+        503: {"description": "Server is busy, please retry later"},
     },
 )
 async def post_secret_file(
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_current_user),
-    file: UploadFile = File(..., description="The file to be uploaded (max 5MB)"),
+    db: AnySession = Depends(get_db),
+    user: Optional[UserPrincipal] = Depends(get_current_user),
+    file: UploadFile = File(
+        ...,
+        description=f"The file to be uploaded (max {SECRET_FILE_MAX_SIZE_MB}MB)",
+    ),
     password: str = Form(..., description="The password for the secret"),
     usage_limit: int = Form(
         ..., description="The usage limit for the secret. 0 = No limit"
@@ -74,31 +113,28 @@ async def post_secret_file(
     ),
 ):
     try:
-        # Check the file size (5MB = 5 * 1024 * 1024 bytes)
-        if file.size > 5 * 1024 * 1024:
+        # Reject early when the client sent the size, read_upload checks it anyway
+        if file.size is not None and file.size > SECRET_FILE_MAX_SIZE:
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="File size exceeds the 5MB limit",
+                detail=f"File size exceeds the {SECRET_FILE_MAX_SIZE_MB}MB limit",
             )
 
-        # Read the file content asynchronously
-        file_content = await file.read()
-
         # Create a SecretCreateFile object with the provided data
         secret_create_file = SecretCreateFile(
             duration=duration,
             password=password,
             usage_limit=usage_limit,
-            file_content=file_content,
             type=SecretType.FILE,
             filename=file.filename,
         )
 
-        # Create the secret in the database
-        created_secret = create_secret_from_file(
+        # Create the secret in the database, encrypting the file chunk by chunk
+        created_secret = await create_secret_from_file(
             db=db,
             user=user,
             secret_create_file=secret_create_file,
+            file_chunks=read_upload(file),
         )
 
         # Return the created secret
@@ -124,11 +160,12 @@ async def post_secret_file(
     responses={
         401: {"description": "Not authenticated"},
         500: {"description": "Internal Server Error"},
+        503: {"description": "Server is busy, please retry later"},
     },
 )
 async def post_secret_text(
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_current_user),
+    db: AnySession = Depends(get_db),
+    user: Optional[UserPrincipal] = Depends(get_current_user),
     content: str = Form(..., description="The text content to be stored as a secret"),
     usage_limit: int = Form(
         ..., description="The usage limit for the secret. 0 = No limit"
@@ -149,7 +186,7 @@ async def post_secret_text(
         )
 
         # Create the secret in the database
-        created_secret = create_secret_from_text(
+        created_secret = await create_secret_from_text(
             db=db,
             user=user,
             secret_create_text=secret_create_text,
@@ -157,6 +194,8 @@ async def post_secret_text(
 
         # Return the created secret
         return created_secret
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error creating secret: {e}")
         raise HTTPException(
@@ -165,6 +204,96 @@ async def post_secret_text(
         )
 
 
+@secrets_router.post(
+    "/batch",
+    response_model=list[SecretBatchResult],
+    summary="Create secret texts in batch",
+    description=f"Create up to {SECRET_BATCH_MAX_SIZE} secret texts in one request. Each item takes the fields of a secret text. Items are created or rejected individually: the result of each item has its status code and either the uuid of the created secret or the error detail.",
+    response_description="The result of each item, in the order of the request",
+    responses={
+        401: {"description": "Not authenticated"},
+        413: {"description": "Batch size exceeds the limit"},
+        500: {"description": "Internal Server Error"},
+    },
+)
+async def post_secrets_batch(
+    db: AnySession = Depends(get_db),
+    user: Optional[UserPrincipal] = Depends(get_current_user),
+    items: list[Any] = Body(
+        ...,
+        description="The secret texts, each with content, password, usage_limit and duration",
+    ),
+):
+    if len(items) > SECRET_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch size exceeds the {SECRET_BATCH_MAX_SIZE} secrets limit",
+        )
+
+    # Items are validated one by one so an invalid item only fails itself
+    results = {}
+    secrets_create_text = {}
+    for index, item in enumerate(items):
+        try:
+            secret = SecretBatchText.model_validate(item)
+        except ValidationError as e:
+            results[index] = SecretBatchResult(
+                index=index,
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                uuid=None,
+                # Without the input, which holds the password
+                detail=jsonable_encoder(
+                    e.errors(
+                        include_url=False, include_context=False, include_input=False
+                    )
+                ),
+            )
+            continue
+        secrets_create_text[index] = SecretCreateText(
+            duration=secret.duration,
+            password=secret.password,
+            usage_limit=secret.usage_limit,
+            text_content=secret.content,
+            type=SecretType.TEXT,
+        )
+
+    try:
+        created = await create_secrets_from_text(
+            db=db,
+            user=user,
+            secrets_create_text=list(secrets_create_text.values()),
+        )
+    except Exception as e:
+        logger.error(f"Error creating secrets: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal Server Error",
+        )
+
+    for index, result in zip(secrets_create_text, created):
+        if isinstance(result, HTTPException):
+            results[index] = SecretBatchResult(
+                index=index,
+                status_code=result.status_code,
+                uuid=None,
+                detail=result.detail,
+            )
+        elif isinstance(result, BaseException):
+            logger.error(f"Error creating secret: {result}")
+            results[index] = SecretBatchResult(
+                index=index,
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                uuid=None,
+                detail="Internal Server Error",
+            )
+        else:
+            results[index] = SecretBatchResult(
+                index=index, status_code=status.HTTP_201_CREATED, uuid=result
+            )
+
+    return [results[index] for index in range(len(items))]
+
+
 @secrets_router.get(
     "/count",
     summary="Get the count of secrets created",
@@ -173,17 +302,14 @@ async def post_secret_text(
         500: {"description": "Internal Server Error"},
     },
 )
-async def get_secret_count(db: Session = Depends(get_db)):
-    async def secret_created_event_generator(db):
-        secret_created_event.set()
-        while True:
-            await secret_created_event.wait()
-            secret_created_event.clear()
-            count = count_secrets(db)
+async def get_secret_count():
+    async def secret_count_generator():
+        # Served from the in-memory count, no database session is held
+        async for count in secret_counter.subscribe():
             yield {"data": str(count)}
 
     return EventSourceResponse(
-        secret_created_event_generator(db),
+        secret_count_generator(),
         send_timeout=30,
     )
 
@@ -205,12 +331,14 @@ async def get_secret_count(db: Session = Depends(get_db)):
     response_description="The type of the retrieved secret",
 )
 async def get_secret_type(
-    secret_uuid: str = Path(..., description="The UUID of the secret to retrieve"),
-    db: Session = Depends(get_db),
+    secret_uuid: uuid.UUID = Path(
+        ..., description="The UUID of the secret to retrieve"
+    ),
+    db: AnySession = Depends(get_db),
 ):
     try:
         # Read the secret from the database
-        secret_type: str = read_secret_type(db, secret_uuid) or "text"
+        secret_type: str = await read_secret_type(db, secret_uuid) or "text"
         return JSONResponse(content=jsonable_encoder({"type": secret_type}))
     except Exception as e:
         logger.error(f"Error retrieving secret type: {e}")
@@ -226,6 +354,7 @@ async def get_secret_type(
         200: {"description": "Successful Response"},
         404: {"description": "Secret not found"},
         500: {"description": "Internal Server Error"},
+        503: {"description": "Server is busy, please retry later"},
     },
     response_model=DecryptedSecret,
     summary="Retrieve a secret",
@@ -233,36 +362,61 @@ async def get_secret_type(
     response_description="The details of the retrieved secret",
 )
 async def get_secret(
-    secret_uuid: str = Path(..., description="The UUID of the secret to retrieve"),
+    background_tasks: BackgroundTasks,
+    secret_uuid: uuid.UUID = Path(
+        ..., description="The UUID of the secret to retrieve"
+    ),
     password: str = Query(..., description="The password for the secret"),
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
 ):
     try:
         # Read the secret from the database
-        secret = read_secret(db, secret_uuid, password)
+        secret = await read_secret(db, secret_uuid, password)
         if not secret:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Secret not found or wrong password or usage limit reached or expired",
             )
 
-        # Decrypt the secret content
-        decrypted_content = decrypt_text(secret.content.content, password)
+        # Re-encrypt legacy Fernet payloads once the response is sent
+        if content_needs_migration(secret):
+            background_tasks.add_task(migrate_legacy_secret, secret.uuid, password)
 
-        # Check if the secret is a file
+        # Check if the secret is a file, decrypted while it is sent
         if secret.content.type == SecretType.FILE.value:
-            file_stream = BytesIO(decrypted_content)
+            headers = {"Content-Disposition": f"filename={secret.content.filename}"}
+            if secret.content.size is not None:
+                headers["Content-Length"] = str(secret.content.size)
             return StreamingResponse(
-                file_stream,
+                phase_chunks(
+                    "read",
+                    "decrypt",
+                    decrypt_stream(
+                        iter_file_content(secret.content),
+                        password,
+                        derived_key_cache.cipher(secret.uuid, password),
+                    ),
+                    payload_size=secret.content.size or 0,
+                ),
                 media_type="application/octet-stream",
-                headers={"Content-Disposition": f"filename={secret.content.filename}"},
+                headers=headers,
             )
         else:
-            secret_dict = secret.__dict__.copy()
-            secret_dict.pop("content", None)
-            decrypted_secret = DecryptedSecret(
-                **secret_dict, content=decrypted_content.decode()
-            )
+            # Decrypt the secret content
+            with phase("read", "decrypt", payload_size=len(secret.content.content)):
+                decrypted_content = decrypt_text(
+                    secret.content.content,
+                    password,
+                    derived_key_cache.cipher(secret.uuid, password),
+                )
+            # Building the model is timed, FastAPI then checks it against
+            # response_model and renders it
+            with phase("read", "serialize"):
+                secret_dict = secret.__dict__.copy()
+                secret_dict.pop("content", None)
+                decrypted_secret = DecryptedSecret(
+                    **secret_dict, content=decrypted_content.decode()
+                )
             return decrypted_secret
     except HTTPException as e:
         raise e
@@ -278,7 +432,7 @@ async def get_secret(
     "/",
     response_model=list[Secret],
     summary="Retrieve all secrets of a user",
-    description="Retrieve all secrets of a user with pagination.",
+    description="Retrieve all secrets of a user with pagination. The X-Next-Cursor response header is the cursor of the next page.",
     response_description="All secrets paginated",
     responses={
         401: {"description": "Not authenticated"},
@@ -286,12 +440,18 @@ async def get_secret(
     },
 )
 async def get_secrets(
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    response: Response,
+    db: AnySession = Depends(get_db),
+    user: UserPrincipal = Depends(get_current_user),
     skip: int = Query(0, description="The number of secrets to skip"),
     limit: int = Query(10, description="The maximum number of secrets to return"),
+    cursor: Optional[str] = Query(
+        None, description="X-Next-Cursor header of the previous page"
+    ),
 ):
     if user:
-        return read_user_secrets(db, user, skip, limit)
+        secrets = await read_user_secrets(db, user, skip, limit, cursor)
+        set_next_cursor(response, secrets, "creation", limit)
+        return secrets
     else:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -1,14 +1,19 @@
+import uuid
+from typing import Optional
+
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
+    Response,
 )
-from sqlalchemy.orm import Session
-from app.models.user import User
+from app.schemas.user import UserPrincipal
 from app.auth_user import get_current_user
 from app.crud.secretLog import read_secret_log, read_secret_logs
 from app.schemas.secretLog import SecretLog
-from app.database import get_db
+from app.database import AnySession, get_db
+from app.pagination import set_next_cursor
 import logging
 
 from app.routers.secret import SECRET_PREFIX
@@ -25,26 +30,38 @@ logger = logging.getLogger(__name__)
 
 @secrets_log_router.get("/", response_model=list[SecretLog])
 async def get_secret_logs(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AnySession = Depends(get_db),
     skip: int = 0,
     limit: int = 10,
-    user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(
+        None, description="X-Next-Cursor header of the previous page"
+    ),
+    user: UserPrincipal = Depends(get_current_user),
 ):
     if user.is_admin:
-        return read_secret_logs(db, skip, limit)
+        logs = await read_secret_logs(db, skip, limit, cursor)
+        set_next_cursor(response, logs, "timestamp", limit)
+        return logs
     else:
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
 @secrets_log_router.get("/{secret_uuid}", response_model=list[SecretLog])
 async def get_secret_logs(
-    secret_uuid: str,
-    db: Session = Depends(get_db),
+    secret_uuid: uuid.UUID,
+    response: Response,
+    db: AnySession = Depends(get_db),
     skip: int = 0,
     limit: int = 10,
-    user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(
+        None, description="X-Next-Cursor header of the previous page"
+    ),
+    user: UserPrincipal = Depends(get_current_user),
 ):
     if user.is_admin:
-        return read_secret_log(db, secret_uuid, skip, limit)
+        logs = await read_secret_log(db, secret_uuid, skip, limit, cursor)
+        set_next_cursor(response, logs, "timestamp", limit)
+        return logs
     else:
         raise HTTPException(status_code=403, detail="Forbidden")
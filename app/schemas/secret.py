@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 
 from pydantic import BaseModel
 
@@ -26,10 +26,23 @@ class SecretCreateText(SecretCreate):
 
 
 class SecretCreateFile(SecretCreate):
-    file_content: bytes
     filename: str
 
 
+class SecretBatchText(BaseModel):
+    content: str
+    password: str
+    usage_limit: int
+    duration: int
+
+
+class SecretBatchResult(BaseModel):
+    index: int
+    status_code: int
+    uuid: Optional[uuid.UUID]
+    detail: Optional[Any] = None
+
+
 class Secret(SecretBase):
     uuid: uuid.UUID
     creation: datetime
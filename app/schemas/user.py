@@ -34,3 +34,7 @@ class User(BaseUser):
 
     class Config:
         from_attributes = True
+
+
+class UserPrincipal(User):
+    is_admin: bool
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import AsyncIterable, AsyncIterator, Optional
+
+import anyio
+
+from app.crypting import SEGMENT_SIZE
+
+# "database" keeps every payload inline, "filesystem" and "s3" move payloads
+# above BLOB_STORAGE_THRESHOLD bytes out of Postgres
+BLOB_STORAGE = os.environ.get("BLOB_STORAGE", "database")
+BLOB_STORAGE_PATH = os.environ.get("BLOB_STORAGE_PATH", "data/blobs")
+BLOB_STORAGE_THRESHOLD = int(os.environ.get("BLOB_STORAGE_THRESHOLD", 256 * 1024))
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+
+
+class BlobStorage(ABC):
+    """
+    S3-style object store for encrypted payloads. Objects are content
+    addressed: the key is the SHA-256 of the stored bytes.
+    """
+
+    @abstractmethod
+    async def put_stream(self, chunks: AsyncIterable[bytes]) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_object(
+        self, key: str, chunk_size: int = SEGMENT_SIZE
+    ) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_object(self, key: str) -> None:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+
+async def _spool(chunks: AsyncIterable[bytes], file) -> str:
+    digest = hashlib.sha256()
+    async for chunk in chunks:
+        digest.update(chunk)
+        await file.write(chunk)
+    await file.flush()
+    return digest.hexdigest()
+
+
+class FilesystemBlobStorage(BlobStorage):
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    async def put_stream(self, chunks: AsyncIterable[bytes]) -> str:
+        await anyio.Path(self.root).mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        try:
+            async with await anyio.open_file(temp_path, "wb") as file:
+                key = await _spool(chunks, file)
+            path = self.local_path(key)
+            await anyio.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            await anyio.to_thread.run_sync(os.replace, temp_path, path)
+        except BaseException:
+            await anyio.Path(temp_path).unlink(missing_ok=True)
+            raise
+        return key
+
+    async def iter_object(
+        self, key: str, chunk_size: int = SEGMENT_SIZE
+    ) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(self.local_path(key), "rb") as file:
+            while chunk := await file.read(chunk_size):
+                yield chunk
+
+    async def delete_object(self, key: str) -> None:
+        await anyio.Path(self.local_path(key)).unlink(missing_ok=True)
+
+
+class S3BlobStorage(BlobStorage):
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None) -> None:
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("BLOB_STORAGE=s3 requires the boto3 package")
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    async def put_stream(self, chunks: AsyncIterable[bytes]) -> str:
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spooled:
+            file = anyio.wrap_file(spooled)
+            key = await _spool(chunks, file)
+            spooled.seek(0)
+            await anyio.to_thread.run_sync(
+                self.client.upload_fileobj, spooled, self.bucket, key
+            )
+        return key
+
+    async def iter_object(
+        self, key: str, chunk_size: int = SEGMENT_SIZE
+    ) -> AsyncIterator[bytes]:
+        response = await anyio.to_thread.run_sync(
+            lambda: self.client.get_object(Bucket=self.bucket, Key=key)
+        )
+        body = response["Body"]
+        try:
+            while chunk := await anyio.to_thread.run_sync(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete_object(self, key: str) -> None:
+        await anyio.to_thread.run_sync(
+            lambda: self.client.delete_object(Bucket=self.bucket, Key=key)
+        )
+
+
+def create_blob_storage() -> Optional[BlobStorage]:
+    if BLOB_STORAGE == "filesystem":
+        return FilesystemBlobStorage(BLOB_STORAGE_PATH)
+    if BLOB_STORAGE == "s3":
+        return S3BlobStorage(S3_BUCKET, S3_ENDPOINT_URL)
+    return None
+
+
+blob_storage = create_blob_storage()
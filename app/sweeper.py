@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import func, select
+
+from app.crud.secrets import purge_expired_secrets
+from app.database import AnySession, maybe_await, open_session
+from app.utils import SWEEPER_DURATION, SWEEPER_SECRETS_PURGED
+
+SWEEPER_ENABLED = os.environ.get("SWEEPER_ENABLED", "true").lower() == "true"
+SWEEPER_INTERVAL = float(os.environ.get("SWEEPER_INTERVAL", 60))
+SWEEPER_BATCH_SIZE = int(os.environ.get("SWEEPER_BATCH_SIZE", 500))
+# Arbitrary key shared by every worker for pg_try_advisory_xact_lock
+SWEEPER_LOCK_ID = 0x5EC2E7
+
+logger = logging.getLogger(__name__)
+
+
+async def acquire_sweep_lock(db: AnySession) -> bool:
+    # Transaction scoped, so the lock is released by each batch commit
+    if db.get_bind().dialect.name != "postgresql":
+        return True
+    return await maybe_await(
+        db.scalar(select(func.pg_try_advisory_xact_lock(SWEEPER_LOCK_ID)))
+    )
+
+
+async def sweep(db: AnySession, batch_size: int = SWEEPER_BATCH_SIZE) -> int:
+    start = time.perf_counter()
+    purged = 0
+    try:
+        while await acquire_sweep_lock(db):
+            batch = await purge_expired_secrets(db, batch_size)
+            purged += batch
+            if batch < batch_size:
+                break
+        # Ends the transaction when the lock was not acquired or nothing purged
+        await maybe_await(db.rollback())
+    finally:
+        SWEEPER_SECRETS_PURGED.inc(purged)
+        SWEEPER_DURATION.observe(time.perf_counter() - start)
+    return purged
+
+
+async def run_sweeper(interval: float = SWEEPER_INTERVAL) -> None:
+    while True:
+        try:
+            async with open_session() as db:
+                purged = await sweep(db)
+            if purged:
+                logger.info(f"Purged {purged} expired secrets")
+        except Exception as e:
+            logger.error(f"Error sweeping expired secrets: {e}")
+        await asyncio.sleep(interval)
+
+
+async def sweep_once() -> None:
+    async with open_session() as db:
+        purged = await sweep(db)
+    print(f"Purged {purged} expired secrets")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete expired secrets")
+    parser.add_argument(
+        "--loop", action="store_true", help="Keep sweeping every SWEEPER_INTERVAL"
+    )
+    args = parser.parse_args()
+    asyncio.run(run_sweeper() if args.loop else sweep_once())
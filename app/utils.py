@@ -1,5 +1,7 @@
+import os
 import time
-from typing import Tuple
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Optional, Sequence, Tuple
 
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
@@ -8,19 +10,36 @@ from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
 from prometheus_client.openmetrics.exposition import (
     CONTENT_TYPE_LATEST,
     generate_latest,
 )
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.requests import Request
 from starlette.responses import Response
-from starlette.routing import Match
+from starlette.routing import BaseRoute, Match, Route
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Set by startServer.py in production mode: every worker writes its metrics
+# to this directory and /metrics aggregates them. Gauges say how the values of
+# the workers are combined, dead workers are dropped from "live" modes.
+# Exemplars are not supported in this mode.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
 
-INFO = Gauge("fastapi_app_info", "FastAPI application information.", ["app_name"])
+INFO = Gauge(
+    "fastapi_app_info",
+    "FastAPI application information.",
+    ["app_name"],
+    multiprocess_mode="max",
+)
 REQUESTS = Counter(
     "fastapi_requests_total",
     "Total count of requests by method and path.",
@@ -36,6 +55,17 @@ REQUESTS_PROCESSING_TIME = Histogram(
     "Histogram of requests processing time by path (in seconds)",
     ["method", "path", "app_name"],
 )
+REQUESTS_TIME_TO_FIRST_BYTE = Histogram(
+    "fastapi_requests_time_to_first_byte_seconds",
+    "Histogram of time until the first response body chunk by path (in seconds)",
+    ["method", "path", "app_name"],
+)
+RESPONSES_BODY_SIZE = Histogram(
+    "fastapi_responses_body_bytes",
+    "Histogram of response body size by path (in bytes)",
+    ["method", "path", "app_name"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
 EXCEPTIONS = Counter(
     "fastapi_exceptions_total",
     "Total count of exceptions raised by path and exception type",
@@ -45,33 +75,270 @@ REQUESTS_IN_PROGRESS = Gauge(
     "fastapi_requests_in_progress",
     "Gauge of requests by method and path currently being processed",
     ["method", "path", "app_name"],
+    multiprocess_mode="livesum",
+)
+HASH_QUEUE_WAIT_TIME = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Histogram of time spent waiting for a hashing worker (in seconds)",
+    ["operation"],
+)
+HASH_PROCESSING_TIME = Histogram(
+    "password_hash_duration_seconds",
+    "Histogram of password hashing time in the worker pool (in seconds)",
+    ["operation"],
+)
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_pending",
+    "Gauge of hashing operations queued or running in the worker pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUT_TIME = Histogram(
+    "db_pool_checkout_duration_seconds",
+    "Histogram of time spent waiting for a database connection (in seconds)",
+    ["driver"],
+)
+DB_POOL_CONNECTIONS_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Gauge of database connections currently checked out of the pool",
+    ["driver"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Gauge of database connections opened beyond the pool size",
+    ["driver"],
+    multiprocess_mode="livesum",
+)
+
+SWEEPER_SECRETS_PURGED = Counter(
+    "sweeper_secrets_purged_total",
+    "Total count of expired secrets deleted by the sweeper",
+)
+SWEEPER_DURATION = Histogram(
+    "sweeper_duration_seconds",
+    "Histogram of expired secrets sweep time (in seconds)",
+)
+AUDIT_LOG_PENDING = Gauge(
+    "audit_log_pending",
+    "Gauge of audit logs waiting in the buffered writer",
+    multiprocess_mode="livesum",
+)
+AUDIT_LOG_FLUSH_TIME = Histogram(
+    "audit_log_flush_duration_seconds",
+    "Histogram of audit log batch insert time (in seconds)",
+)
+AUDIT_LOG_DROPPED = Counter(
+    "audit_log_dropped_total",
+    "Total count of audit logs dropped after their batch insert failed twice",
+)
+SECRET_PHASE_TIME = Histogram(
+    "secret_phase_duration_seconds",
+    "Histogram of secret create and read time by phase (in seconds)",
+    ["operation", "phase"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Histogram of event loop scheduling lag (in seconds)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocked_total",
+    "Total count of event loop blocks beyond the threshold by path",
+    ["path"],
+)
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Total count of in-process cache hits by cache",
+    ["cache"],
+)
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Total count of in-process cache misses by cache",
+    ["cache"],
 )
 
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
+# Resolves to the tracer provider set by setting_otlp once it is called
+tracer = trace.get_tracer(__name__)
+
+
+@contextmanager
+def phase(operation: str, name: str, **attributes) -> Iterator[trace.Span]:
+    """
+    Times a phase (hash, db_query, db_commit, encrypt, decrypt, serialize) of
+    a secret operation in SECRET_PHASE_TIME and as a child span of the request.
+    """
+    start = time.perf_counter()
+    with tracer.start_as_current_span(
+        f"{operation} {name}", attributes=attributes
+    ) as span:
+        try:
+            yield span
+        finally:
+            SECRET_PHASE_TIME.labels(operation=operation, phase=name).observe(
+                time.perf_counter() - start
+            )
+
+
+async def phase_chunks(
+    operation: str, name: str, chunks: AsyncIterator[bytes], **attributes
+) -> AsyncIterator[bytes]:
+    """
+    phase() for a payload produced chunk by chunk while it is streamed: the
+    histogram only gets the time spent producing the chunks, the span lasts
+    until the last one is consumed.
+    """
+    elapsed = 0.0
+    size = 0
+    # Not made current: the context would leak to the consumer between chunks
+    span = tracer.start_span(f"{operation} {name}", attributes=attributes)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            size += len(chunk)
+            yield chunk
+    finally:
+        span.set_attribute("secret.stream_size", size)
+        span.end()
+        SECRET_PHASE_TIME.labels(operation=operation, phase=name).observe(elapsed)
+
+
+def _first_segment(path: str) -> Optional[str]:
+    segment = path.lstrip("/").split("/", 1)[0]
+    return None if "{" in segment else segment
+
+
+class RouteIndex:
+    """
+    Route templates by method: paths without parameters are a dict lookup,
+    the others only try the few routes sharing their first path segment.
+    Candidates keep the app.routes order, the first full match wins as in
+    Starlette routing.
+    """
+
+    ANY_METHOD = "*"
+
+    def __init__(self, routes: Sequence[BaseRoute]) -> None:
+        methods = {self.ANY_METHOD}
+        for route in routes:
+            if isinstance(route, Route) and route.methods:
+                methods.update(route.methods)
+
+        segments = {None}
+        for route in routes:
+            if isinstance(route, Route):
+                segments.add(_first_segment(route.path))
+
+        self.candidates: dict[Tuple[str, Optional[str]], list[BaseRoute]] = {
+            (method, segment): [
+                route for route in routes if self._may_match(route, method, segment)
+            ]
+            for method in methods
+            for segment in segments
+        }
+
+        self.static: dict[Tuple[str, str], str] = {}
+        for (method, segment), candidates in self.candidates.items():
+            for position, route in enumerate(candidates):
+                if (
+                    isinstance(route, Route)
+                    and not route.param_convertors
+                    and not any(
+                        self._shadows(earlier, route.path)
+                        for earlier in candidates[:position]
+                    )
+                ):
+                    self.static[(method, route.path)] = route.path
+
+    def _may_match(self, route: BaseRoute, method: str, segment: Optional[str]) -> bool:
+        # Mounts and other route types are always tried with route.matches()
+        if not isinstance(route, Route):
+            return True
+        if route.methods and method not in route.methods:
+            return False
+        route_segment = _first_segment(route.path)
+        return route_segment is None or route_segment == segment
+
+    @staticmethod
+    def _shadows(route: BaseRoute, path: str) -> bool:
+        return not isinstance(route, Route) or bool(route.path_regex.match(path))
+
+    def get_path(self, scope) -> Optional[str]:
+        path = scope["path"]
+        method = scope["method"]
+        if (method, None) not in self.candidates:
+            method = self.ANY_METHOD
+        static_path = self.static.get((method, path))
+        if static_path is not None:
+            return static_path
+        segment = path.lstrip("/").split("/", 1)[0]
+        candidates = self.candidates.get((method, segment))
+        if candidates is None:
+            candidates = self.candidates[(method, None)]
+
+        for route in candidates:
+            if isinstance(route, Route):
+                if route.path_regex.match(path):
+                    return route.path
+            elif route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return None
+
+
+class PrometheusMiddleware:
+    """
+    Raw ASGI middleware: the response is observed through the send messages,
+    so streamed bodies (file downloads, SSE) are passed through untouched.
+    """
+
     def __init__(self, app: ASGIApp, app_name: str = "fastapi-app") -> None:
-        super().__init__(app)
+        self.app = app
         self.app_name = app_name
+        self.route_index = None
         INFO.labels(app_name=self.app_name).inc()
 
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        method = request.method
-        path, is_handled_path = self.get_path(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path, is_handled_path = self.get_path(scope)
 
         if not is_handled_path:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         REQUESTS_IN_PROGRESS.labels(
             method=method, path=path, app_name=self.app_name
         ).inc()
         REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
         before_time = time.perf_counter()
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+        body_size = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                if body_size is None:
+                    body_size = 0
+                    REQUESTS_TIME_TO_FIRST_BYTE.labels(
+                        method=method, path=path, app_name=self.app_name
+                    ).observe(time.perf_counter() - before_time)
+                body_size += len(message.get("body", b""))
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except BaseException as e:
-            status_code = HTTP_500_INTERNAL_SERVER_ERROR
             EXCEPTIONS.labels(
                 method=method,
                 path=path,
@@ -80,7 +347,6 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             ).inc()
             raise e from None
         else:
-            status_code = response.status_code
             after_time = time.perf_counter()
             # retrieve trace id for exemplar
             span = trace.get_current_span()
@@ -89,6 +355,9 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             REQUESTS_PROCESSING_TIME.labels(
                 method=method, path=path, app_name=self.app_name
             ).observe(after_time - before_time, exemplar={"TraceID": trace_id})
+            RESPONSES_BODY_SIZE.labels(
+                method=method, path=path, app_name=self.app_name
+            ).observe(body_size or 0)
         finally:
             RESPONSES.labels(
                 method=method,
@@ -100,21 +369,25 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
                 method=method, path=path, app_name=self.app_name
             ).dec()
 
-        return response
-
-    @staticmethod
-    def get_path(request: Request) -> Tuple[str, bool]:
-        for route in request.app.routes:
-            match, child_scope = route.matches(request.scope)
-            if match == Match.FULL:
-                return route.path, True
+    def get_path(self, scope: Scope) -> Tuple[str, bool]:
+        # Built on the first request, once every route has been registered
+        if self.route_index is None:
+            self.route_index = RouteIndex(scope["app"].routes)
+        path = self.route_index.get_path(scope)
+        if path is not None:
+            return path, True
 
-        return request.url.path, False
+        return scope["path"], False
 
 
 def metrics(request: Request) -> Response:
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        # A new registry per scrape, reading the files of all workers
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
     return Response(
-        generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST}
+        generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST}
     )
 
 
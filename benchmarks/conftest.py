@@ -0,0 +1,2 @@
+# Scripts, not tests: load_test.py matches pytest's *_test.py pattern
+collect_ignore_glob = ["*.py"]
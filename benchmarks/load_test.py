@@ -0,0 +1,377 @@
+"""
+Latency and throughput of the secrets API, driven in process through httpx's
+ASGI transport against SQLite or a local Postgres.
+
+    python -m benchmarks.load_test --output results.json
+    python -m benchmarks.load_test --database-url postgresql://user:pw@localhost/bench
+    python -m benchmarks.load_test --compare results.json
+
+Each scenario reports p50/p95/p99 latency, requests per second and the peak
+RSS of the process so far. Results carry the git commit, so runs of two
+commits on the same machine can be compared with --compare.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Keep the trace exporter away from a real collector
+os.environ.setdefault("OTLP_GRPC_ENDPOINT", "http://localhost:0")
+
+from app.crud.secrets import count_secrets  # noqa: E402
+from app.database import Base, get_db  # noqa: E402
+from app.events import secret_counter  # noqa: E402
+from app.main import app  # noqa: E402
+from app.partitions import manage_partitions  # noqa: E402
+
+PASSWORD = "benchmark-password"
+KB = 1024
+
+
+def percentile(quantiles: list[float], value: int) -> float:
+    return round(quantiles[value - 1] * 1000, 3)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        # Peak of the whole process: kilobytes on Linux, bytes on macOS
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+async def run_scenario(send_request, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(index)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            index = queue.get_nowait()
+            start = time.perf_counter()
+            response = await send_request(index)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+class SSESubscriber:
+    """
+    Calls the /secrets/count endpoint as a raw ASGI client: httpx's ASGI
+    transport buffers whole responses, so it cannot read an endless stream.
+    """
+
+    def __init__(self, updated: asyncio.Condition) -> None:
+        self.updated = updated
+        self.count = None
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] != "http.response.body":
+            return
+        for line in message.get("body", b"").decode().splitlines():
+            if line.startswith("data:"):
+                self.count = int(line[len("data:") :])
+                async with self.updated:
+                    self.updated.notify_all()
+
+    async def run(self):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/secrets/count",
+            "raw_path": b"/secrets/count",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        await app(scope, self.receive, self.send)
+
+
+async def sse_fan_out(client, subscribers: int, requests: int) -> dict:
+    """
+    Latency from the start of a create request until every subscriber has
+    received the new count.
+    """
+    updated = asyncio.Condition()
+    clients = [SSESubscriber(updated) for _ in range(subscribers)]
+    tasks = [asyncio.create_task(subscriber.run()) for subscriber in clients]
+    async with updated:
+        await updated.wait_for(lambda: all(s.count is not None for s in clients))
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        expected = secret_counter.count + 1
+        request_start = time.perf_counter()
+        response = await create_text(client)
+        if response.status_code >= 400:
+            errors += 1
+            continue
+        async with updated:
+            await updated.wait_for(lambda: all(s.count >= expected for s in clients))
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+
+    for subscriber in clients:
+        subscriber.disconnected.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {"subscribers": subscribers, **summarize(latencies, errors, elapsed)}
+
+
+async def create_text(client, headers: dict | None = None):
+    return await client.post(
+        "/secrets/text",
+        headers=headers,
+        data={
+            "content": "benchmark secret",
+            "password": PASSWORD,
+            "usage_limit": "1",
+            "duration": "60",
+        },
+    )
+
+
+async def create_text_batch(client, size: int):
+    return await client.post(
+        "/secrets/batch",
+        json=[
+            {
+                "content": "benchmark secret",
+                "password": PASSWORD,
+                "usage_limit": 1,
+                "duration": 60,
+            }
+        ]
+        * size,
+    )
+
+
+async def create_file(client, payload: bytes):
+    return await client.post(
+        "/secrets/file",
+        data={"password": PASSWORD, "usage_limit": "1", "duration": "60"},
+        files={"file": ("benchmark.bin", payload)},
+    )
+
+
+async def benchmark(args) -> dict:
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        await client.post(
+            "/register", data={"username": "benchmark", "password": PASSWORD}
+        )
+        response = await client.post(
+            "/login", data={"username": "benchmark", "password": PASSWORD}
+        )
+        auth = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        results["create_text"] = await run_scenario(
+            lambda _: create_text(client), args.requests, args.concurrency
+        )
+
+        # Latency is per batch: rps times --batch-size is secrets per second
+        results[f"create_text_batch_{args.batch_size}"] = await run_scenario(
+            lambda _: create_text_batch(client, args.batch_size),
+            args.batch_requests,
+            args.concurrency,
+        )
+
+        for size in args.file_sizes:
+            payload = os.urandom(size * KB)
+            results[f"create_file_{size}kb"] = await run_scenario(
+                lambda _: create_file(client, payload),
+                args.file_requests,
+                args.concurrency,
+            )
+
+        # One secret per read, as one-time secrets are the common case
+        secret_uuids = []
+        for _ in range(args.requests):
+            secret_uuids.append((await create_text(client)).json()["uuid"])
+        results["get_secret"] = await run_scenario(
+            lambda index: client.get(
+                f"/secrets/{secret_uuids[index]}", params={"password": PASSWORD}
+            ),
+            args.requests,
+            args.concurrency,
+        )
+
+        secret_uuid = (await create_text(client)).json()["uuid"]
+        results["get_secret_type"] = await run_scenario(
+            lambda _: client.get(f"/secrets/{secret_uuid}/type"),
+            args.requests,
+            args.concurrency,
+        )
+
+        for _ in range(args.list_size):
+            await create_text(client, auth)
+        results["list_secrets"] = await run_scenario(
+            lambda _: client.get("/secrets/", headers=auth, params={"limit": 50}),
+            args.requests,
+            args.concurrency,
+        )
+
+        results["sse_fan_out"] = await sse_fan_out(
+            client, args.sse_subscribers, args.sse_requests
+        )
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_database(database_url: str):
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    SessionBenchmark = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+
+    async def get_benchmark_db():
+        db = SessionBenchmark()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = get_benchmark_db
+    return engine, SessionBenchmark
+
+
+async def main(args) -> dict:
+    engine, SessionBenchmark = setup_database(args.database_url)
+    with SessionBenchmark() as db:
+        await manage_partitions(db)
+
+    # What the startup event does for the SSE stream
+    async def load_count():
+        with SessionBenchmark() as db:
+            return await count_secrets(db)
+
+    await secret_counter.run(load_count)
+
+    scenarios = await benchmark(args)
+    engine.dispose()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(
+        f"{'scenario':<24} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8}   "
+        f"(vs {baseline['meta']['commit']})",
+        file=sys.stderr,
+    )
+    for name, result in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        ratios = [
+            result[key] / previous[key] if previous[key] else float("nan")
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps")
+        ]
+        print(
+            f"{name:<24} " + " ".join(f"{ratio:>7.2f}x" for ratio in ratios),
+            file=sys.stderr,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the secrets API")
+    parser.add_argument(
+        "--database-url",
+        default=f"sqlite:///{tempfile.mkdtemp()}/benchmark.db",
+        help="SQLAlchemy URL of an empty database (default: temporary SQLite)",
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--file-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1, 256, 4096],
+        help="Comma separated file sizes in KB",
+    )
+    parser.add_argument("--file-requests", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-requests", type=int, default=20)
+    parser.add_argument("--list-size", type=int, default=100)
+    parser.add_argument("--sse-subscribers", type=int, default=100)
+    parser.add_argument("--sse-requests", type=int, default=50)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+    # Skip the exporters started on import
+    os._exit(0)
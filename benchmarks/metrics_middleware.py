@@ -0,0 +1,100 @@
+"""
+Throughput of the metrics middleware on a JSON route and a streamed route,
+against the previous BaseHTTPMiddleware implementation.
+
+    python -m benchmarks.metrics_middleware
+"""
+
+import asyncio
+import os
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.utils import (
+    REQUESTS,
+    REQUESTS_PROCESSING_TIME,
+    RESPONSES,
+    PrometheusMiddleware,
+    RouteIndex,
+)
+
+REQUESTS_COUNT = 2000
+CHUNKS = 16
+
+
+class BaseHTTPPrometheusMiddleware(BaseHTTPMiddleware):
+    # Previous PrometheusMiddleware, reduced to the metrics it recorded
+    def __init__(self, app, app_name="fastapi-app"):
+        super().__init__(app)
+        self.app_name = app_name
+        self.route_index = None
+
+    async def dispatch(self, request, call_next):
+        if self.route_index is None:
+            self.route_index = RouteIndex(request.app.routes)
+        path = self.route_index.get_path(request.scope)
+        labels = dict(method=request.method, path=path, app_name=self.app_name)
+        REQUESTS.labels(**labels).inc()
+        before_time = time.perf_counter()
+        response = await call_next(request)
+        REQUESTS_PROCESSING_TIME.labels(**labels).observe(
+            time.perf_counter() - before_time
+        )
+        RESPONSES.labels(**labels, status_code=response.status_code).inc()
+        return response
+
+
+def create_app(middleware_class=None):
+    app = FastAPI()
+    if middleware_class is not None:
+        app.add_middleware(middleware_class, app_name="benchmark")
+
+    @app.get("/json/{name}")
+    async def json_route(name: str):
+        return {"name": name}
+
+    async def chunks():
+        for _ in range(CHUNKS):
+            yield b"x" * 4096
+
+    @app.get("/stream/{name}")
+    async def stream_route(name: str):
+        return StreamingResponse(chunks())
+
+    return app
+
+
+async def requests_per_second(app, url):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        await client.get(url)
+        start = time.perf_counter()
+        for _ in range(REQUESTS_COUNT):
+            await client.get(url)
+        return REQUESTS_COUNT / (time.perf_counter() - start)
+
+
+async def main():
+    candidates = {
+        "none": None,
+        "BaseHTTPMiddleware": BaseHTTPPrometheusMiddleware,
+        "ASGI": PrometheusMiddleware,
+    }
+    print(f"{'middleware':<20} {'json req/s':>12} {'stream req/s':>14}")
+    for name, middleware_class in candidates.items():
+        app = create_app(middleware_class)
+        json_rps = await requests_per_second(app, "/json/a")
+        stream_rps = await requests_per_second(app, "/stream/a")
+        print(f"{name:<20} {json_rps:>12.0f} {stream_rps:>14.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    # Skip the exporters started on import
+    os._exit(0)
@@ -0,0 +1,152 @@
+"""
+Compares the two startServer.py launchers over real TCP connections: the dev
+one (a single process with reload) and the production one (SERVER_WORKERS
+workers with uvloop and httptools). The server runs the app as deployed, so
+the Postgres settings must be in the environment.
+
+    python -m benchmarks.server_modes --output results.json
+    python -m benchmarks.server_modes --workers 4 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.load_test import PASSWORD, git_commit, run_scenario
+
+MODES = ("dev", "production")
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SERVER_MODE": mode,
+        "SERVER_PORT": str(port),
+        "SERVER_WORKERS": str(workers),
+    }
+    # Own process group, so the reloader or supervisor goes with its children
+    return subprocess.Popen(
+        [sys.executable, "startServer.py"], env=env, start_new_session=True
+    )
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("Server did not start")
+        await asyncio.sleep(0.2)
+
+
+async def benchmark_mode(mode: str, args) -> dict:
+    process = start_server(mode, args.port, args.workers)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}",
+            timeout=None,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            await wait_ready(client, args.startup_timeout)
+
+            def create_text(_):
+                return client.post(
+                    "/secrets/text",
+                    data={
+                        "content": "benchmark secret",
+                        "password": PASSWORD,
+                        "usage_limit": "1",
+                        "duration": "60",
+                    },
+                )
+
+            secret_uuid = (await create_text(None)).json()["uuid"]
+            return {
+                # Bound by PBKDF2, spread over the workers in production
+                "create_text": await run_scenario(
+                    create_text, args.requests, args.concurrency
+                ),
+                # Served from the secret type cache: mostly server overhead
+                "get_secret_type": await run_scenario(
+                    lambda _: client.get(f"/secrets/{secret_uuid}/type"),
+                    args.requests,
+                    args.concurrency,
+                ),
+            }
+    finally:
+        stop_server(process)
+
+
+async def main(args) -> dict:
+    modes = {}
+    for mode in MODES:
+        modes[mode] = await benchmark_mode(mode, args)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "cpu_count": os.cpu_count(),
+            "workers": args.workers,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "modes": modes,
+    }
+
+
+def compare(results: dict) -> None:
+    print(
+        f"{'production vs dev':<24} {'p50':>8} {'p99':>8} {'rps':>8}", file=sys.stderr
+    )
+    for name, production in results["modes"]["production"].items():
+        dev = results["modes"]["dev"][name]
+        ratios = [
+            production[key] / dev[key] if dev[key] else float("nan")
+            for key in ("p50_ms", "p99_ms", "rps")
+        ]
+        print(
+            f"{name:<24} " + " ".join(f"{ratio:>7.2f}x" for ratio in ratios),
+            file=sys.stderr,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the server launchers")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    compare(results)
+    # Skip the exporters started on import
+    os._exit(0)
@@ -1,14 +1,205 @@
+import copy
+import glob
+import logging
+import multiprocessing
+import operator
+import os
+import random
+import signal
+import threading
+
 import uvicorn
+from prometheus_client import multiprocess
+from prometheus_client.mmap_dict import MmapedDict
+
+# "dev" : un seul processus avec rechargement du code
+# "production" : plusieurs workers uvloop/httptools supervisés
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8081))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", os.cpu_count() or 1))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", 2048))
+# Plus long que le délai d'inactivité du proxy (90s pour Traefik), pour que ce
+# soit toujours lui qui ferme les connexions inutilisées
+SERVER_KEEP_ALIVE = int(os.environ.get("SERVER_KEEP_ALIVE", 95))
+# Par worker, les flux SSE compris. Au-delà, uvicorn répond 503
+SERVER_LIMIT_CONCURRENCY = int(os.environ.get("SERVER_LIMIT_CONCURRENCY", 1000))
+SERVER_MAX_REQUESTS = int(os.environ.get("SERVER_MAX_REQUESTS", 10000))
+SERVER_MAX_REQUESTS_JITTER = int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", 1000))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+# Métriques Prometheus partagées par les workers, voir app/utils.py
+PROMETHEUS_MULTIPROC_DIR = os.environ.get(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc"
+)
+WORKER_CHECK_INTERVAL = 1
+# Fichiers de métriques des workers morts, fusionnés par type en un seul
+# fichier "<type>_merged.db" et comment les valeurs se combinent. Les jauges
+# "live" sont supprimées par mark_process_dead, les autres modes n'ont pas de
+# fichier par worker à fusionner
+MERGED_METRICS = {
+    "counter": operator.add,
+    "histogram": operator.add,
+    "summary": operator.add,
+    "gauge_max": max,
+}
+
+logger = logging.getLogger("uvicorn.error")
+spawn = multiprocessing.get_context("spawn")
+
+
+def merge_dead_metrics(pids: list) -> None:
+    """
+    Fusionne les métriques des workers morts : sans cela, chaque worker
+    redémarré laisse ses fichiers, qui s'accumulent et sont tous relus à chaque
+    /metrics. Le fichier fusionné est remplacé d'un coup, puis ceux des workers
+    supprimés : une collecte entre les deux compte ces workers en double.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR", PROMETHEUS_MULTIPROC_DIR)
+    for prefix, combine in MERGED_METRICS.items():
+        files = [os.path.join(path, f"{prefix}_{pid}.db") for pid in pids]
+        files = [f for f in files if os.path.exists(f)]
+        if not files:
+            continue
+        merged = os.path.join(path, f"{prefix}_merged.db")
+        values = {}
+        for f in ([merged] if os.path.exists(merged) else []) + files:
+            for key, value, _, _ in MmapedDict.read_all_values_from_file(f):
+                values[key] = combine(values[key], value) if key in values else value
+
+        # Hors du motif "*.db" lu par /metrics tant qu'il n'est pas complet
+        tmp = f"{merged}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        merged_dict = MmapedDict(tmp)
+        for key, value in values.items():
+            merged_dict.write_value(key, value, 0.0)
+        merged_dict.close()
+        os.replace(tmp, merged)
+        for f in files:
+            os.remove(f)
+
+
+def run_worker(config: uvicorn.Config, sockets: list) -> None:
+    """
+    Point d'entrée d'un worker : la configuration des logs ne survit pas au
+    spawn, elle est refaite avant de servir sur les sockets du superviseur.
+    """
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class WorkerSupervisor:
+    """
+    Lance les workers sur la socket partagée et remplace ceux qui s'arrêtent,
+    ce que le Multiprocess d'uvicorn 0.22 ne fait pas. Chaque worker a sa
+    propre limite de requêtes, pour qu'ils ne redémarrent pas tous ensemble.
+    """
+
+    def __init__(self, config: uvicorn.Config, sockets: list) -> None:
+        self.config = config
+        self.sockets = sockets
+        self.processes = []
+        self.should_exit = threading.Event()
+
+    def signal_handler(self, sig, frame) -> None:
+        self.should_exit.set()
+
+    def spawn(self):
+        config = copy.copy(self.config)
+        if config.limit_max_requests:
+            config.limit_max_requests += random.randint(0, SERVER_MAX_REQUESTS_JITTER)
+        process = spawn.Process(
+            target=run_worker, kwargs={"config": config, "sockets": self.sockets}
+        )
+        process.start()
+        return process
+
+    def restart_dead_workers(self) -> None:
+        dead_pids = []
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                process.join()
+                multiprocess.mark_process_dead(process.pid)
+                dead_pids.append(process.pid)
+                logger.info(
+                    f"Worker [{process.pid}] exited with code {process.exitcode}, restarting"
+                )
+                self.processes[index] = self.spawn()
+        if dead_pids:
+            merge_dead_metrics(dead_pids)
+
+    def stop(self) -> None:
+        # SIGTERM : chaque worker termine ses requêtes en cours, au plus
+        # SERVER_GRACEFUL_TIMEOUT secondes
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+            multiprocess.mark_process_dead(process.pid)
+
+    def run(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.signal_handler)
+        logger.info(f"Started supervisor process [{os.getpid()}]")
+
+        self.processes = [self.spawn() for _ in range(self.config.workers)]
+        while not self.should_exit.wait(WORKER_CHECK_INTERVAL):
+            self.restart_dead_workers()
+        self.stop()
+        logger.info(f"Stopping supervisor process [{os.getpid()}]")
+
+
+def production_config(app: str = "app.main:app") -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=SERVER_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEP_ALIVE,
+        limit_concurrency=SERVER_LIMIT_CONCURRENCY,
+        limit_max_requests=SERVER_MAX_REQUESTS or None,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        log_config="log_config.yaml",
+    )
+
+
+def prepare_metrics_dir() -> None:
+    """
+    Vide le répertoire des métriques d'une exécution précédente et le transmet
+    aux workers, qui doivent le connaître avant d'importer prometheus_client.
+    """
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "*.db")):
+        os.remove(path)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = PROMETHEUS_MULTIPROC_DIR
+
+
+def start_production(app: str = "app.main:app"):
+    """
+    Démarre SERVER_WORKERS workers uvicorn derrière un superviseur.
+    """
+    prepare_metrics_dir()
+    config = production_config(app)
+    # Liée une seule fois par le superviseur, puis partagée par les workers
+    sock = config.bind_socket()
+    WorkerSupervisor(config, [sock]).run()
 
 
 def start_uvicorn():
     """
     Démarre le serveur Uvicorn en utilisant directement son API Python.
     """
+    if SERVER_MODE == "production":
+        start_production()
+        return
+
     uvicorn.run(
         "app.main:app",
-        host="0.0.0.0",
-        port=8081,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
         reload=True,
         log_config="log_config.yaml",
         reload_dirs=["/app"],
@@ -1,22 +1,44 @@
 import pytest
+import pytest_asyncio
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from app.database import Base
+from app.database import Base, maybe_await
 from app.models.user import User
 import uuid
 
 uuid = uuid.UUID("550e8400-e29b-41d4-a716-446655440000", version=4)
 
 
-@pytest.fixture
-def db_session():
-    # Création d'une base SQLite en mémoire
-    engine = create_engine("sqlite:///:memory:")
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@pytest_asyncio.fixture(params=["sync", "async"])
+async def db_session(request, tmp_path):
+    if request.param == "async":
+        # AsyncSession as with DATABASE_DRIVER=asyncpg, on aiosqlite
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        # Same session settings as app.database.AsyncSessionLocal
+        TestingSessionLocal = async_sessionmaker(
+            bind=engine, autoflush=False, expire_on_commit=False
+        )
+    else:
+        # Création d'une base SQLite en mémoire
+        # One connection shared by the threads the crud functions run the
+        # Session calls on, see app.database.run_db
+        engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        # Same session settings as app.database.SessionLocal
+        TestingSessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+        )
 
-    # Création des tables
-    Base.metadata.create_all(bind=engine)
+        # Création des tables
+        Base.metadata.create_all(bind=engine)
     db = TestingSessionLocal()
 
     # Ajoute un utilisateur de test
@@ -26,13 +48,26 @@ def db_session():
         hashed_password="hashedpassword",
     )
     db.add(test_user)
-    db.commit()
-    db.refresh(test_user)
+    await maybe_await(db.commit())
+    await maybe_await(db.refresh(test_user))
 
     yield db
 
     # Fermeture et suppression
-    db.close()
+    await maybe_await(db.close())
+    if request.param == "async":
+        await engine.dispose()
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # SQLite file shared by several sessions, for tests that need concurrency
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+    engine.dispose()
 
 
 @pytest.fixture
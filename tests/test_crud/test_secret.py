@@ -1,11 +1,54 @@
-from app.crud.secrets import create_secret_from_text, read_secret
-from app.crypting import decrypt_text
-from app.schemas.secret import SecretCreateText, SecretType
+from sqlalchemy import event, func, select, update
+
+from app.crud.secretLog import read_secret_log
+from app.crud import secrets
+from app.crud.secrets import (
+    content_needs_migration,
+    create_secret_from_file,
+    create_secret_from_text,
+    create_secrets_from_text,
+    iter_file_content,
+    count_secrets,
+    migrate_legacy_content,
+    purge_expired_secrets,
+    read_secret,
+    read_secret_type,
+    read_user_secrets,
+)
+from app.database import maybe_await
+from app.pagination import encode_cursor
+from app.crypting import (
+    SEGMENT_SIZE,
+    decrypt_stream,
+    decrypt_text,
+    derive_key,
+    encrypt_text,
+    is_legacy_encrypted,
+    iter_chunks,
+)
+from app.schemas.secret import SecretCreateFile, SecretCreateText, SecretType
+from app.models.secret import Secret
+from app.models.secretContent import SecretContent
+from app.schemas.secretLog import SecretLogActionEnum
+from app.hash_manager import HashingSaturatedError
+from app.storage import FilesystemBlobStorage
 import asyncio
+import base64
+import os
+from datetime import datetime, timedelta
+
 import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+
+
+def sync_session(db):
+    # Events are listened to on the Session behind an AsyncSession
+    return getattr(db, "sync_session", db)
 
 
-def test_create_secret_from_text(
+@pytest.mark.asyncio
+async def test_create_secret_from_text(
     db_session,
     user,
     duration=1,
@@ -25,7 +68,7 @@ def test_create_secret_from_text(
     )
 
     # Create the secret in the database
-    result = create_secret_from_text(
+    result = await create_secret_from_text(
         db=db_session,
         user=user,
         secret_create_text=secret_create_text,
@@ -42,11 +85,12 @@ def test_create_secret_from_text(
     return result
 
 
-def test_read_secret_success(db_session, user):
+@pytest.mark.asyncio
+async def test_read_secret_success(db_session, user):
     password = "password"
-    secret = test_create_secret_from_text(db_session, user, password=password)
+    secret = await test_create_secret_from_text(db_session, user, password=password)
 
-    result = read_secret(db_session, secret.uuid, password)
+    result = await read_secret(db_session, secret.uuid, password)
 
     assert result == secret
     assert secret.usage_count == 1
@@ -55,7 +99,7 @@ def test_read_secret_success(db_session, user):
 @pytest.mark.asyncio
 async def test_read_secret_expired(db_session, user):
     password = "password"
-    secret = test_create_secret_from_text(
+    secret = await test_create_secret_from_text(
         db_session,
         user,
         password=password,
@@ -64,35 +108,366 @@ async def test_read_secret_expired(db_session, user):
 
     await asyncio.sleep(61)
 
-    result = read_secret(db_session, secret.uuid, password)
+    result = await read_secret(db_session, secret.uuid, password)
 
     assert result is None
 
 
-def test_read_secret_usage_limit_exceeded(db_session, user):
+@pytest.mark.asyncio
+async def test_read_secret_usage_limit_exceeded(db_session, user):
     password = "password"
-    secret = test_create_secret_from_text(
+    secret = await test_create_secret_from_text(
         db_session,
         user,
         password=password,
         usage_limit=1,
         usage_count=1,
     )
-    read_secret(db_session, secret.uuid, password)
-    result = read_secret(db_session, secret.uuid, password)
+    await read_secret(db_session, secret.uuid, password)
+    result = await read_secret(db_session, secret.uuid, password)
 
     assert result is None
 
 
-def test_read_secret_invalid_password(db_session, user):
+@pytest.mark.asyncio
+async def test_read_secret_invalid_password(db_session, user):
     password = "password"
-    secret = test_create_secret_from_text(
+    secret = await test_create_secret_from_text(
         db_session,
         user,
         password=password,
         usage_limit=1,
         usage_count=1,
     )
-    result = read_secret(db_session, secret.uuid, "wrong_password")
+    result = await read_secret(db_session, secret.uuid, "wrong_password")
 
     assert result is None
+
+
+@pytest.mark.asyncio
+async def test_create_secret_single_commit(db_session, user):
+    commits = []
+    event.listen(sync_session(db_session), "after_commit", commits.append)
+
+    secret = await test_create_secret_from_text(db_session, user)
+
+    assert len(commits) == 1
+    logs = await read_secret_log(db_session, secret.uuid)
+    assert [log.action for log in logs] == [SecretLogActionEnum.CREATE]
+
+
+@pytest.mark.asyncio
+async def test_read_secret_concurrent_usage_limit(session_factory, user):
+    password = "password"
+    usage_limit = 3
+    sessions = [session_factory() for _ in range(10)]
+    secret = await test_create_secret_from_text(
+        sessions[0], user, password=password, usage_limit=usage_limit
+    )
+
+    results = await asyncio.gather(
+        *(read_secret(db, secret.uuid, password) for db in sessions)
+    )
+
+    assert len([result for result in results if result]) == usage_limit
+    logs = await read_secret_log(sessions[0], secret.uuid)
+    assert [log.action for log in logs].count(SecretLogActionEnum.GET) == usage_limit
+    assert [log.action for log in logs].count(SecretLogActionEnum.EXPIRE) == 1
+    for db in sessions:
+        db.close()
+
+
+async def decrypt_all(content: bytes, password: str) -> bytes:
+    return b"".join(
+        [chunk async for chunk in decrypt_stream(iter_chunks(content, 1000), password)]
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [0, 10, SEGMENT_SIZE, 3 * SEGMENT_SIZE + 7])
+async def test_create_secret_from_file(db_session, user, size):
+    password = "password"
+    file_content = os.urandom(size)
+    secret_create_file = SecretCreateFile(
+        duration=0,
+        password=password,
+        usage_limit=1,
+        type=SecretType.FILE,
+        filename="file.bin",
+    )
+
+    result = await create_secret_from_file(
+        db=db_session,
+        user=user,
+        secret_create_file=secret_create_file,
+        file_chunks=iter_chunks(file_content, 4096),
+    )
+
+    assert result.content.filename == "file.bin"
+    assert await decrypt_all(result.content.content, password) == file_content
+    with pytest.raises(InvalidTag):
+        await decrypt_all(result.content.content[:-1], password)
+
+
+@pytest.mark.asyncio
+async def test_create_secret_from_file_blob_storage(
+    db_session, user, tmp_path, monkeypatch
+):
+    password = "password"
+    storage = FilesystemBlobStorage(str(tmp_path))
+    monkeypatch.setattr(secrets, "blob_storage", storage)
+    monkeypatch.setattr(secrets, "BLOB_STORAGE_THRESHOLD", 1000)
+    file_content = os.urandom(2 * SEGMENT_SIZE)
+    secret_create_file = SecretCreateFile(
+        duration=0,
+        password=password,
+        usage_limit=1,
+        type=SecretType.FILE,
+        filename="file.bin",
+    )
+
+    result = await create_secret_from_file(
+        db=db_session,
+        user=user,
+        secret_create_file=secret_create_file,
+        file_chunks=iter_chunks(file_content, 4096),
+    )
+
+    assert result.content.content is None
+    assert result.content.size == len(file_content)
+    assert os.path.exists(storage.local_path(result.content.storage_key))
+    decrypted_chunks = decrypt_stream(iter_file_content(result.content), password)
+    assert b"".join([chunk async for chunk in decrypted_chunks]) == file_content
+
+
+@pytest.mark.asyncio
+async def test_purge_keeps_used_up_file_during_grace(
+    db_session, user, tmp_path, monkeypatch
+):
+    password = "password"
+    storage = FilesystemBlobStorage(str(tmp_path))
+    monkeypatch.setattr(secrets, "blob_storage", storage)
+    monkeypatch.setattr(secrets, "BLOB_STORAGE_THRESHOLD", 1000)
+    file_content = os.urandom(2 * SEGMENT_SIZE)
+    created = await create_secret_from_file(
+        db=db_session,
+        user=user,
+        secret_create_file=SecretCreateFile(
+            duration=0,
+            password=password,
+            usage_limit=1,
+            type=SecretType.FILE,
+            filename="file.bin",
+        ),
+        file_chunks=iter_chunks(file_content, 4096),
+    )
+
+    # The last use is committed before the download opens the blob
+    secret = await read_secret(db_session, created.uuid, password)
+    assert await purge_expired_secrets(db_session) == 0
+    decrypted_chunks = decrypt_stream(iter_file_content(secret.content), password)
+    assert b"".join([chunk async for chunk in decrypted_chunks]) == file_content
+
+    # Once the grace period is over
+    await maybe_await(
+        db_session.execute(
+            update(Secret)
+            .filter(Secret.uuid == created.uuid)
+            .values(destruction=datetime.now())
+        )
+    )
+    assert await purge_expired_secrets(db_session) == 1
+    assert not os.path.exists(storage.local_path(secret.content.storage_key))
+
+
+def encrypt_fernet(content: bytes, password: str) -> bytes:
+    return Fernet(base64.urlsafe_b64encode(derive_key(password))).encrypt(content)
+
+
+@pytest.mark.asyncio
+async def test_decrypt_stream_legacy_fernet():
+    file_content = os.urandom(5000)
+
+    content = encrypt_fernet(file_content, "password")
+
+    assert await decrypt_all(content, "password") == file_content
+
+
+def test_encrypt_text_binary_envelope():
+    text = os.urandom(3000)
+
+    content = encrypt_text(text, "password")
+
+    assert len(content) == len(text) + 1 + 12 + 16
+    assert decrypt_text(content, "password") == text
+    assert decrypt_text(encrypt_fernet(text, "password"), "password") == text
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_content(db_session, user):
+    password = "password"
+    secret = await test_create_secret_from_text(
+        db_session, user, password=password, usage_limit=2
+    )
+    secret.content.content = encrypt_fernet(b"content", password)
+    await maybe_await(db_session.commit())
+
+    result = await read_secret(db_session, secret.uuid, password)
+    assert content_needs_migration(result)
+    await migrate_legacy_content(db_session, secret.uuid, password)
+
+    assert not is_legacy_encrypted(secret.content.content)
+    assert decrypt_text(secret.content.content, password) == b"content"
+    assert not content_needs_migration(secret)
+
+
+@pytest.mark.asyncio
+async def test_purge_expired_secrets(db_session, user, monkeypatch):
+    monkeypatch.setattr(secrets, "SECRET_PURGE_GRACE", 0)
+    password = "password"
+    alive = await test_create_secret_from_text(db_session, user, password=password)
+    used_up = await test_create_secret_from_text(db_session, user, password=password)
+    expired = await test_create_secret_from_text(db_session, user, password=password)
+    await read_secret(db_session, used_up.uuid, password)
+    # The last use is recorded as the destruction, which the sweeper scans
+    destruction = await maybe_await(
+        db_session.scalar(
+            select(Secret.destruction).filter(Secret.uuid == used_up.uuid)
+        )
+    )
+    assert destruction <= datetime.now()
+    expired.destruction = datetime.now() - timedelta(minutes=1)
+    await maybe_await(db_session.commit())
+    purged_uuids = [used_up.uuid, expired.uuid]
+
+    assert await purge_expired_secrets(db_session, batch_size=1) == 1
+    assert await purge_expired_secrets(db_session) == 1
+    assert await purge_expired_secrets(db_session) == 0
+
+    assert await count_secrets(db_session) == 1
+    assert (
+        await maybe_await(
+            db_session.scalar(select(func.count()).select_from(SecretContent))
+        )
+        == 1
+    )
+    assert await read_secret(db_session, alive.uuid, password) is not None
+    for secret_uuid in purged_uuids:
+        logs = await read_secret_log(db_session, secret_uuid)
+        assert [log.action for log in logs].count(SecretLogActionEnum.EXPIRE) == 1
+
+
+@pytest.mark.asyncio
+async def test_read_user_secrets_cursor(db_session, user):
+    created_secrets = [
+        await test_create_secret_from_text(db_session, user) for _ in range(3)
+    ]
+
+    first_page = await read_user_secrets(db_session, user, limit=2)
+    cursor = encode_cursor(first_page[-1].creation, first_page[-1].uuid)
+    second_page = await read_user_secrets(db_session, user, limit=2, cursor=cursor)
+
+    assert [secret.uuid for secret in first_page + second_page] == [
+        secret.uuid for secret in created_secrets
+    ]
+
+
+@pytest.mark.asyncio
+async def test_read_secret_type(db_session, user):
+    secrets.secret_type_cache.clear()
+    secret = await test_create_secret_from_text(db_session, user)
+    statements = []
+    event.listen(
+        sync_session(db_session).get_bind(),
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    assert await read_secret_type(db_session, secret.uuid) == "text"
+    assert await read_secret_type(db_session, secret.uuid) == "text"
+
+    # One query on the base content table, then served from the cache
+    assert len(statements) == 1
+    assert "secret_text_content" not in statements[0]
+    secrets.secret_type_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_payload_loaded_after_verification(db_session, user):
+    secret = await test_create_secret_from_text(db_session, user, password="password")
+    db_session.expunge_all()
+    statements = []
+    event.listen(
+        sync_session(db_session).get_bind(),
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    await read_user_secrets(db_session, user)
+    assert await read_secret(db_session, secret.uuid, "wrong_password") is None
+    assert not any("secret_text_content" in statement for statement in statements)
+
+    result = await read_secret(db_session, secret.uuid, "password")
+    assert decrypt_text(result.content.content, "password") == b"content"
+
+
+@pytest.mark.asyncio
+async def test_read_secret_derived_key_cache(db_session, user, monkeypatch):
+    secret = await test_create_secret_from_text(
+        db_session, user, password="password", usage_limit=3
+    )
+    verifications = []
+    verify_password = secrets.hashing_service.verify_password
+
+    async def counting_verify_password(*args):
+        verifications.append(args)
+        return await verify_password(*args)
+
+    monkeypatch.setattr(
+        secrets.hashing_service, "verify_password", counting_verify_password
+    )
+
+    assert await read_secret(db_session, secret.uuid, "password") is not None
+    assert await read_secret(db_session, secret.uuid, "wrong_password") is None
+    assert await read_secret(db_session, secret.uuid, "password") is not None
+    assert len(verifications) == 2
+    assert secrets.derived_key_cache.cipher(secret.uuid, "password") is not None
+
+    # The last use drops the cached key
+    assert await read_secret(db_session, secret.uuid, "password") is not None
+    assert secrets.derived_key_cache.cipher(secret.uuid, "password") is None
+
+
+@pytest.mark.asyncio
+async def test_create_secrets_from_text(db_session, user, monkeypatch):
+    hash_and_encrypt = secrets.hashing_service.hash_and_encrypt
+
+    async def saturated_for_busy(password, content):
+        if password == "busy":
+            raise HashingSaturatedError()
+        return await hash_and_encrypt(password, content)
+
+    monkeypatch.setattr(secrets.hashing_service, "hash_and_encrypt", saturated_for_busy)
+    commits = []
+    event.listen(sync_session(db_session), "after_commit", commits.append)
+
+    results = await create_secrets_from_text(
+        db_session,
+        user,
+        [
+            SecretCreateText(
+                duration=1, password=password, usage_limit=1, text_content=password
+            )
+            for password in ("first", "busy", "second")
+        ],
+    )
+
+    assert len(commits) == 1
+    assert isinstance(results[1], HashingSaturatedError)
+    assert await count_secrets(db_session) == 2
+    for secret_uuid, password in ((results[0], "first"), (results[2], "second")):
+        secret = await read_secret(db_session, secret_uuid, password)
+        assert secret.user_uuid == user.uuid
+        assert decrypt_text(secret.content.content, password) == password.encode()
+        logs = await read_secret_log(db_session, secret_uuid)
+        assert [log.action for log in logs][0] == SecretLogActionEnum.CREATE
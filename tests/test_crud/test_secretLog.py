@@ -1,15 +1,23 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.crud import secretLog
 from app.crud.secretLog import create_secret_logs, read_secret_log, read_secret_logs
 from app.crud.secrets import read_secret
+from app.database import maybe_await
+from app.pagination import encode_cursor
 from app.schemas.secretLog import SecretLogActionEnum
 from tests.test_crud.test_secret import test_create_secret_from_text
+import pytest
 
 
-def test_create_secret_logs(
+@pytest.mark.asyncio
+async def test_create_secret_logs(
     db_session,
     user,
 ):
-    created_secret = test_create_secret_from_text(db_session, user)
-    result = create_secret_logs(
+    created_secret = await test_create_secret_from_text(db_session, user)
+    result = await create_secret_logs(
         db=db_session,
         secret_uuid=created_secret.uuid,
         action=SecretLogActionEnum.GET,
@@ -17,31 +25,34 @@ def test_create_secret_logs(
     assert result.secret_id == created_secret.uuid
 
 
-def test_read_secret_logs(db_session, user):
-    created_secret_1 = test_create_secret_from_text(db_session, user)
-    created_secret_2 = test_create_secret_from_text(db_session, user)
+@pytest.mark.asyncio
+async def test_read_secret_logs(db_session, user):
+    created_secret_1 = await test_create_secret_from_text(db_session, user)
+    created_secret_2 = await test_create_secret_from_text(db_session, user)
 
-    result = read_secret_logs(db_session)
+    result = await read_secret_logs(db_session)
 
     assert len(result) == 2
     assert result[0].secret_id == created_secret_1.uuid
     assert result[1].secret_id == created_secret_2.uuid
 
 
-def test_read_secret_log(db_session, user):
-    created_secret = test_create_secret_from_text(db_session, user)
-    result = read_secret_log(db_session, created_secret.uuid)
+@pytest.mark.asyncio
+async def test_read_secret_log(db_session, user):
+    created_secret = await test_create_secret_from_text(db_session, user)
+    result = await read_secret_log(db_session, created_secret.uuid)
     assert result[0].secret_id == created_secret.uuid
     assert result[0].action == SecretLogActionEnum.CREATE
 
 
-def test_secret_log_enum(db_session, user):
+@pytest.mark.asyncio
+async def test_secret_log_enum(db_session, user):
     password = "password"
-    created_create_secret = test_create_secret_from_text(
+    created_create_secret = await test_create_secret_from_text(
         db_session, user, password=password, usage_limit=1
     )
-    read_secret(db_session, created_create_secret.uuid, password)
-    result = read_secret_log(db_session, created_create_secret.uuid)
+    await read_secret(db_session, created_create_secret.uuid, password)
+    result = await read_secret_log(db_session, created_create_secret.uuid)
 
     assert result[0].secret_id == created_create_secret.uuid
     assert result[0].action == SecretLogActionEnum.CREATE
@@ -51,3 +62,62 @@ def test_secret_log_enum(db_session, user):
 
     assert result[2].secret_id == created_create_secret.uuid
     assert result[2].action == SecretLogActionEnum.EXPIRE
+
+
+@pytest.mark.asyncio
+async def test_read_secret_logs_cursor(db_session, user):
+    created_secrets = [
+        await test_create_secret_from_text(db_session, user) for _ in range(5)
+    ]
+
+    first_page = await read_secret_logs(db_session, limit=2)
+    last = first_page[-1]
+    cursor = encode_cursor(last.timestamp, last.uuid)
+    second_page = await read_secret_logs(db_session, limit=2, cursor=cursor)
+    assert second_page == await read_secret_logs(db_session, skip=2, limit=2)
+
+    result = (
+        first_page
+        + second_page
+        + await read_secret_logs(
+            db_session,
+            limit=2,
+            cursor=encode_cursor(second_page[-1].timestamp, second_page[-1].uuid),
+        )
+    )
+    assert [log.secret_id for log in result] == [
+        secret.uuid for secret in created_secrets
+    ]
+
+
+@pytest.mark.asyncio
+async def test_buffered_logs_enqueued_after_commit(db_session, user, monkeypatch):
+    enqueued = []
+
+    async def enqueue(secret_uuid, action):
+        enqueued.append((secret_uuid, action))
+
+    monkeypatch.setattr(secretLog, "AUDIT_LOG_MODE", "buffered")
+    monkeypatch.setattr(secretLog.secret_log_writer, "enqueue", enqueue)
+    created_secret = await test_create_secret_from_text(db_session, user)
+    secret_uuid = created_secret.uuid
+    enqueued.clear()
+
+    def fail_commit(session):
+        raise RuntimeError("commit failed")
+
+    event.listen(Session, "before_commit", fail_commit)
+    try:
+        await secretLog.record_secret_log(
+            db_session, secret_uuid, SecretLogActionEnum.GET
+        )
+        with pytest.raises(RuntimeError):
+            await secretLog.commit_with_logs(db_session)
+    finally:
+        event.remove(Session, "before_commit", fail_commit)
+    await maybe_await(db_session.rollback())
+    assert enqueued == []
+
+    await secretLog.record_secret_log(db_session, secret_uuid, SecretLogActionEnum.GET)
+    await secretLog.commit_with_logs(db_session)
+    assert enqueued == [(secret_uuid, SecretLogActionEnum.GET)]
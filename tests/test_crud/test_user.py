@@ -1,66 +1,83 @@
+import threading
 from uuid import uuid4
 
-from app.crud.user import create_user, get_user_by_username_password, get_user_by_uuid
+import pytest
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import Session
+
+from app.crud.user import (
+    create_user,
+    get_user_by_username_password,
+    get_user_by_uuid,
+    get_user_principal,
+    invalidate_user_cache,
+)
+from app.database import maybe_await
 from app.hash_manager import verify_password
 from app.schemas.user import UserCreate
 
 
-def test_create_user(db_session):
+@pytest.mark.asyncio
+async def test_create_user(db_session):
 
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
 
-def test_create_user_with_same_username(db_session):
+@pytest.mark.asyncio
+async def test_create_user_with_same_username(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
     second_user_create = UserCreate(username="username", password="different_password")
-    second_result = create_user(db_session, second_user_create)
+    second_result = await create_user(db_session, second_user_create)
 
     assert second_result == None
 
 
-def test_create_user_with_same_username_different_password(db_session):
+@pytest.mark.asyncio
+async def test_create_user_with_same_username_different_password(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
     second_user_create = UserCreate(username="username", password="different_password")
-    second_result = create_user(db_session, second_user_create)
+    second_result = await create_user(db_session, second_user_create)
 
     assert second_result == None
 
 
-def test_get_user_by_uuid(db_session):
+@pytest.mark.asyncio
+async def test_get_user_by_uuid(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
-    result = get_user_by_uuid(db_session, result.uuid)
+    result = await get_user_by_uuid(db_session, result.uuid)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
 
-def test_get_user_by_username_password(db_session):
+@pytest.mark.asyncio
+async def test_get_user_by_username_password(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
-    result = get_user_by_username_password(
+    result = await get_user_by_username_password(
         db_session, user_create.username, user_create.password
     )
 
@@ -68,30 +85,99 @@ def test_get_user_by_username_password(db_session):
     assert verify_password(user_create.password, result.hashed_password)
 
 
-def test_get_user_by_uuid_not_found(db_session):
+@pytest.mark.asyncio
+async def test_get_user_by_uuid_not_found(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
-    result = get_user_by_uuid(db_session, uuid4())
+    result = await get_user_by_uuid(db_session, uuid4())
     assert result is None
 
 
-def test_get_user_not_found_empty_db(db_session):
-    result = get_user_by_uuid(db_session, uuid4())
+@pytest.mark.asyncio
+async def test_get_user_not_found_empty_db(db_session):
+    result = await get_user_by_uuid(db_session, uuid4())
     assert result == None
 
 
-def test_get_user_with_wrong_password(db_session):
+@pytest.mark.asyncio
+async def test_get_user_with_wrong_password(db_session):
     user_create = UserCreate(username="username", password="password")
-    result = create_user(db_session, user_create)
+    result = await create_user(db_session, user_create)
 
     assert result.username == user_create.username
     assert verify_password(user_create.password, result.hashed_password)
 
-    result = get_user_by_username_password(
+    result = await get_user_by_username_password(
         db_session, user_create.username, "wrong_password"
     )
     assert result == None
+
+
+@pytest.mark.asyncio
+async def test_get_user_principal_cached(db_session):
+    invalidate_user_cache()
+    user_create = UserCreate(username="username", password="password")
+    user = await create_user(db_session, user_create)
+
+    principal = await get_user_principal(db_session, user.uuid)
+    assert principal.uuid == user.uuid
+    assert principal.is_admin is False
+
+    # Served from the cache until the user row changes
+    await maybe_await(db_session.close())
+    assert await get_user_principal(db_session, user.uuid) is principal
+
+    user = await get_user_by_uuid(db_session, user.uuid)
+    user.is_admin = True
+    await maybe_await(db_session.flush())
+    # Invalidated once committed, not at flush
+    assert await get_user_principal(db_session, user.uuid) is principal
+    await maybe_await(db_session.commit())
+
+    principal = await get_user_principal(db_session, user.uuid)
+    assert principal.is_admin is True
+    invalidate_user_cache()
+
+
+@pytest.mark.asyncio
+async def test_get_user_principal_rollback_keeps_cache(db_session):
+    invalidate_user_cache()
+    user_create = UserCreate(username="username", password="password")
+    user = await create_user(db_session, user_create)
+    user_uuid = user.uuid
+    principal = await get_user_principal(db_session, user_uuid)
+
+    user.is_admin = True
+    await maybe_await(db_session.flush())
+    await maybe_await(db_session.rollback())
+    assert await get_user_principal(db_session, user_uuid) is principal
+
+    # A later commit does not invalidate the rolled back change
+    await maybe_await(db_session.commit())
+    assert await get_user_principal(db_session, user_uuid) is principal
+    assert principal.is_admin is False
+    invalidate_user_cache()
+
+
+@pytest.mark.asyncio
+async def test_auth_queries_run_off_the_event_loop(db_session):
+    if not isinstance(db_session, Session):
+        pytest.skip("AsyncSession queries already run on the driver thread")
+    query_threads = set()
+
+    def record_thread(*args):
+        query_threads.add(threading.get_ident())
+
+    event.listen(Engine, "before_cursor_execute", record_thread)
+    try:
+        await create_user(db_session, UserCreate(username="user", password="pass"))
+        assert await get_user_by_username_password(db_session, "user", "pass")
+    finally:
+        event.remove(Engine, "before_cursor_execute", record_thread)
+
+    assert query_threads
+    assert threading.get_ident() not in query_threads
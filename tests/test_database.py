@@ -0,0 +1,45 @@
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+from app.database import MeteredQueuePool, instrument_pool
+
+
+class SmallPool(MeteredQueuePool):
+    driver = "test"
+
+
+def sample(name):
+    return REGISTRY.get_sample_value(name, {"driver": "test"}) or 0
+
+
+def test_pool_metrics(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=SmallPool,
+        pool_size=1,
+        max_overflow=2,
+    )
+    instrument_pool(engine, SmallPool.driver)
+    checkouts = sample("db_pool_checkout_duration_seconds_count")
+
+    connections = [engine.connect() for _ in range(3)]
+    assert sample("db_pool_connections_in_use") == 3
+    assert sample("db_pool_overflow") == 2
+    assert sample("db_pool_checkout_duration_seconds_count") == checkouts + 3
+
+    # The first one returned stays in the pool, the overflow ones are closed
+    for connection in connections:
+        connection.close()
+    assert sample("db_pool_connections_in_use") == 0
+    assert sample("db_pool_overflow") == 0
+
+    with engine.connect():
+        assert sample("db_pool_connections_in_use") == 1
+        assert sample("db_pool_overflow") == 0
+    assert sample("db_pool_checkout_duration_seconds_count") == checkouts + 4
+
+    connection = engine.connect()
+    connection.invalidate()
+    connection.close()
+    assert sample("db_pool_connections_in_use") == 0
+    engine.dispose()
@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+import pytest
+
+from app.events import CountBroadcaster
+
+
+async def load_count():
+    return 3
+
+
+@pytest.mark.asyncio
+async def test_count_broadcaster_fan_out():
+    broadcaster = CountBroadcaster()
+    await broadcaster.run(load_count)
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+
+    assert await anext(first) == 3
+    assert await anext(second) == 3
+
+    broadcaster.add(1)
+    broadcaster.add(-2)
+
+    # Subscribers only receive the latest count
+    assert await asyncio.wait_for(anext(first), 1) == 2
+    assert await asyncio.wait_for(anext(second), 1) == 2
+    await first.aclose()
+    await second.aclose()
+    assert not broadcaster.subscribers
+
+
+@pytest.mark.asyncio
+async def test_count_broadcaster_notifications():
+    broadcaster = CountBroadcaster()
+    await broadcaster.run(load_count)
+
+    broadcaster._on_notification(None, 0, "secret_count", "1:5")
+    broadcaster._on_notification(None, 0, "secret_count", f"{os.getpid()}:5")
+
+    assert broadcaster.count == 8
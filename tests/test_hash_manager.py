@@ -0,0 +1,49 @@
+import pytest
+
+from app.crypting import decrypt_text
+from app.hash_manager import HashingSaturatedError, HashingService
+
+
+@pytest.mark.asyncio
+async def test_hashing_service_hash_and_verify():
+    service = HashingService(workers=1, max_pending=2)
+
+    hashed_password = await service.hash_password("password")
+
+    assert await service.verify_password("password", hashed_password)
+    assert not await service.verify_password("wrong_password", hashed_password)
+    assert service.pending == 0
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hashing_service_saturated():
+    service = HashingService(workers=1, max_pending=0)
+
+    with pytest.raises(HashingSaturatedError) as e:
+        await service.hash_password("password")
+
+    assert e.value.status_code == 503
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hashing_service_hash_and_encrypt():
+    service = HashingService(workers=1, max_pending=2)
+
+    hashed_password, encrypted = await service.hash_and_encrypt("password", b"text")
+
+    assert await service.verify_password("password", hashed_password)
+    assert decrypt_text(encrypted, "password") == b"text"
+    service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hashing_service_process_executor():
+    service = HashingService(executor="process", workers=1, max_pending=2)
+
+    hashed_password = await service.hash_password("password")
+
+    assert service._executor._mp_context.get_start_method() == "spawn"
+    assert await service.verify_password("password", hashed_password)
+    service.shutdown()
@@ -0,0 +1,29 @@
+import uuid
+from datetime import datetime, timedelta
+
+from app.key_cache import DerivedKeyCache
+
+
+def test_derived_key_cache():
+    cache = DerivedKeyCache(maxsize=1, ttl=60)
+    first, second = uuid.uuid4(), uuid.uuid4()
+
+    cache.put(first, "password")
+    entry = cache.keys.peek(str(first))
+    assert cache.verify(first, "password")
+    assert not cache.verify(first, "wrong_password")
+
+    # Evicted entries are zeroized
+    cache.put(second, "password")
+    assert not cache.verify(first, "password")
+    assert entry.key == bytearray(len(entry.key))
+    assert entry.aesgcm is None
+
+
+def test_derived_key_cache_expired_secret():
+    cache = DerivedKeyCache(maxsize=10, ttl=60)
+    secret_uuid = uuid.uuid4()
+
+    cache.put(secret_uuid, "password", datetime.now() - timedelta(seconds=1))
+
+    assert not cache.verify(secret_uuid, "password")
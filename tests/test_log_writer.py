@@ -0,0 +1,112 @@
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import func, select
+
+from app.log_writer import SecretLogWriter
+from app.models.secretLogs import SecretLogs
+from app.schemas.secretLog import SecretLogActionEnum
+
+
+def count_logs(session_factory):
+    with session_factory() as db:
+        return db.scalar(select(func.count()).select_from(SecretLogs))
+
+
+def create_writer(session_factory, **kwargs):
+    @asynccontextmanager
+    async def session_opener():
+        with session_factory() as db:
+            yield db
+
+    return SecretLogWriter(session_opener=session_opener, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_secret_log_writer_batches(session_factory):
+    writer = create_writer(session_factory, batch_size=3, flush_interval=60)
+    writer.start()
+
+    for _ in range(2):
+        await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.GET)
+    await asyncio.sleep(0.1)
+    assert count_logs(session_factory) == 0
+
+    # A full batch is flushed without waiting for the interval
+    await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.GET)
+    await asyncio.sleep(0.1)
+    assert count_logs(session_factory) == 3
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_secret_log_writer_drains_on_stop(session_factory):
+    writer = create_writer(session_factory, batch_size=100, flush_interval=60)
+    writer.start()
+
+    for _ in range(5):
+        await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.CREATE)
+    await writer.stop()
+
+    assert writer.pending == []
+    assert count_logs(session_factory) == 5
+
+
+@pytest.mark.asyncio
+async def test_secret_log_writer_back_pressure(session_factory):
+    writer = create_writer(session_factory, batch_size=2, max_pending=4)
+
+    for _ in range(4):
+        await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.GET)
+
+    assert writer.pending == []
+    assert count_logs(session_factory) == 4
+
+
+def create_failing_writer(session_factory, failures, **kwargs):
+    writer = create_writer(session_factory, retry_delay=0, **kwargs)
+    insert = writer.insert
+
+    async def failing_insert(rows):
+        if failures:
+            failures.pop()
+            raise RuntimeError("database unavailable")
+        await insert(rows)
+
+    writer.insert = failing_insert
+    return writer
+
+
+def dropped():
+    return REGISTRY.get_sample_value("audit_log_dropped_total") or 0
+
+
+@pytest.mark.asyncio
+async def test_secret_log_writer_retries_failed_batch(session_factory):
+    writer = create_failing_writer(session_factory, [True], batch_size=10)
+    observed = dropped()
+
+    for _ in range(3):
+        await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.GET)
+    await writer.flush()
+
+    assert count_logs(session_factory) == 3
+    assert dropped() == observed
+
+
+@pytest.mark.asyncio
+async def test_secret_log_writer_counts_dropped_logs(session_factory):
+    writer = create_failing_writer(session_factory, [True, True], batch_size=2)
+    observed = dropped()
+
+    for _ in range(3):
+        await writer.enqueue(uuid.uuid4(), SecretLogActionEnum.GET)
+    await writer.flush()
+
+    # The first batch fails twice, the second one is written
+    assert writer.pending == []
+    assert count_logs(session_factory) == 1
+    assert dropped() == observed + 2
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+
+from app.loop_monitor import LoopMonitor, LoopMonitorMiddleware
+
+
+def lag_count():
+    return REGISTRY.get_sample_value("event_loop_lag_seconds_count") or 0
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_lag():
+    monitor = LoopMonitor(interval=0.01, debug=False)
+    observed = lag_count()
+    monitor.start()
+    time.sleep(0.05)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert lag_count() > observed
+    assert monitor.watchdog is None
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_reports_blocking_route(caplog):
+    monitor = LoopMonitor(interval=0.01, debug=True, block_threshold=0.05)
+    app = FastAPI()
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+
+    @app.get("/block/{name}")
+    async def block(name: str):
+        time.sleep(0.3)
+        return {}
+
+    labels = {"path": "/block/{name}"}
+    blocks = REGISTRY.get_sample_value("event_loop_blocked_total", labels) or 0
+    monitor.start()
+    transport = httpx.ASGITransport(app=app)
+    with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            await client.get("/block/a")
+    await monitor.stop()
+
+    assert REGISTRY.get_sample_value("event_loop_blocked_total", labels) == blocks + 1
+    assert "in block" in caplog.text
+    assert monitor.current == {}
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_attributes_block_among_concurrent_requests(caplog):
+    monitor = LoopMonitor(interval=0.01, debug=True, block_threshold=0.05)
+    app = FastAPI()
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+
+    @app.get("/late-block")
+    async def late_block():
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)
+        return {}
+
+    @app.get("/wait")
+    async def wait():
+        await asyncio.sleep(0.2)
+        return {}
+
+    counts = {
+        path: REGISTRY.get_sample_value("event_loop_blocked_total", {"path": path}) or 0
+        for path in ("/late-block", "/wait")
+    }
+    monitor.start()
+    transport = httpx.ASGITransport(app=app)
+    with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            # /wait starts last, the block still belongs to /late-block
+            block = asyncio.create_task(client.get("/late-block"))
+            await asyncio.sleep(0.01)
+            await asyncio.gather(block, client.get("/wait"))
+    await monitor.stop()
+
+    labels = {"path": "/late-block"}
+    assert (
+        REGISTRY.get_sample_value("event_loop_blocked_total", labels)
+        == counts["/late-block"] + 1
+    )
+    assert (
+        REGISTRY.get_sample_value("event_loop_blocked_total", {"path": "/wait"}) or 0
+    ) == counts["/wait"]
+    assert "in late_block" in caplog.text
+    assert monitor.current == {}
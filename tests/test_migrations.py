@@ -0,0 +1,48 @@
+import re
+
+from sqlalchemy import create_engine, event
+
+from app.migrations import (
+    INDEX_MIGRATIONS,
+    SCHEMA_MIGRATIONS,
+    create_index_sql,
+    migrate_schema,
+)
+from app.models.secret import Secret
+
+
+def test_migrate_schema_skips_other_databases():
+    engine = create_engine("sqlite://")
+    statements = []
+    event.listen(
+        engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    migrate_schema(engine)
+
+    assert statements == []
+
+
+def test_schema_migrations_are_idempotent():
+    for statement in SCHEMA_MIGRATIONS:
+        if re.search(r"\b(ADD COLUMN|CREATE INDEX|DROP CONSTRAINT)\b", statement):
+            assert re.search(r"\bIF (NOT )?EXISTS\b", statement), statement
+
+
+def test_create_index_sql():
+    assert create_index_sql("secret", "ix_secret_creation_uuid", "creation, uuid") == (
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_secret_creation_uuid" '
+        'ON "secret" (creation, uuid)'
+    )
+
+
+def test_index_migrations_match_models():
+    # Same names and columns as the indexes create_all makes on new databases
+    indexes = {
+        index.name: [column.name for column in index.columns]
+        for index in Secret.__table__.indexes
+    }
+    for table, name, columns in INDEX_MIGRATIONS:
+        assert indexes[name] == [
+            column.strip().strip('"') for column in columns.split(",")
+        ]
@@ -0,0 +1,110 @@
+from datetime import date
+
+import pytest
+
+from app.partitions import (
+    add_months,
+    copy_legacy_rows_sql,
+    create_default_partition_sql,
+    create_partition_sql,
+    drop_partition_sql,
+    manage_partitions,
+    partition_name,
+    plan_partitions,
+    reclaim_default_rows_sql,
+    rename_legacy_table_sql,
+)
+
+
+def test_add_months():
+    assert add_months(date(2024, 11, 1), 1) == date(2024, 12, 1)
+    assert add_months(date(2024, 12, 1), 1) == date(2025, 1, 1)
+    assert add_months(date(2025, 1, 1), -13) == date(2023, 12, 1)
+
+
+def test_partition_name():
+    assert partition_name(date(2025, 3, 1)) == "secretLogs_y2025m03"
+
+
+@pytest.mark.asyncio
+async def test_manage_partitions_without_postgres(db_session):
+    assert await manage_partitions(db_session) == ([], [])
+
+
+def test_plan_partitions_creates_missing_months():
+    existing = ["secretLogs_y2024m12", "secretLogs_default"]
+    months, expired = plan_partitions(date(2024, 11, 30), existing, 2, 0)
+
+    assert months == [date(2024, 11, 1), date(2025, 1, 1)]
+    assert expired == []
+
+
+def test_plan_partitions_retention_zero_keeps_everything():
+    existing = ["secretLogs_y2000m01", "secretLogs_y2024m10"]
+    assert plan_partitions(date(2025, 1, 1), existing, 0, 0)[1] == []
+
+
+def test_plan_partitions_drops_partitions_older_than_retention():
+    existing = [
+        "secretLogs_y2024m09",
+        "secretLogs_y2024m10",
+        "secretLogs_y2024m11",
+        "secretLogs_y2025m01",
+        "secretLogs_default",
+        "other_table",
+    ]
+    months, expired = plan_partitions(date(2025, 1, 15), existing, 0, 2)
+
+    # The cutoff is 2024-11-01: October ends exactly on it, November does not
+    assert months == []
+    assert expired == ["secretLogs_y2024m09", "secretLogs_y2024m10"]
+
+
+def test_partition_sql():
+    assert create_partition_sql(date(2024, 12, 1)) == (
+        'CREATE TABLE "secretLogs_y2024m12" PARTITION OF "secretLogs" '
+        "FOR VALUES FROM ('2024-12-01 00:00+00') TO ('2025-01-01 00:00+00')"
+    )
+    assert create_default_partition_sql() == (
+        'CREATE TABLE "secretLogs_default" PARTITION OF "secretLogs" DEFAULT'
+    )
+    assert drop_partition_sql("secretLogs_y2024m01") == (
+        'DROP TABLE "secretLogs_y2024m01"'
+    )
+
+
+def test_reclaim_default_rows_sql():
+    statements = reclaim_default_rows_sql(date(2025, 2, 1))
+
+    assert statements[0].endswith('DETACH PARTITION "secretLogs_default"')
+    assert statements[1] == create_partition_sql(date(2025, 2, 1))
+    assert statements[2].startswith(
+        'INSERT INTO "secretLogs" SELECT * FROM "secretLogs_default"'
+    )
+    assert statements[3].startswith('DELETE FROM "secretLogs_default"')
+    assert "'2025-02-01 00:00+00'" in statements[3]
+    assert "'2025-03-01 00:00+00'" in statements[3]
+    assert statements[4].endswith('ATTACH PARTITION "secretLogs_default" DEFAULT')
+
+
+def test_plan_partitions_from_first_month():
+    existing = ["secretLogs_y2025m01"]
+    months, _ = plan_partitions(
+        date(2025, 1, 10), existing, 1, 0, first_month=date(2024, 11, 20)
+    )
+
+    assert months == [date(2024, 11, 1), date(2024, 12, 1), date(2025, 2, 1)]
+
+
+def test_legacy_table_sql():
+    assert rename_legacy_table_sql() == [
+        'ALTER TABLE "secretLogs" RENAME TO "secretLogs_legacy"',
+        'ALTER INDEX IF EXISTS "secretLogs_pkey" RENAME TO "secretLogs_legacy_pkey"',
+        'DROP INDEX IF EXISTS "ix_secretLogs_secret_id_timestamp_uuid"',
+        'DROP INDEX IF EXISTS "ix_secretLogs_timestamp_uuid"',
+    ]
+    assert copy_legacy_rows_sql() == (
+        'INSERT INTO "secretLogs" (uuid, action, "timestamp", secret_id) '
+        "SELECT uuid, action, COALESCE(\"timestamp\", 'epoch'), secret_id "
+        'FROM "secretLogs_legacy"'
+    )
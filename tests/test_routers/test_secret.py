@@ -0,0 +1,140 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from sqlalchemy import func, select
+
+from app.auth_user import get_current_user
+from app.database import get_db, maybe_await
+from app.models.secret import Secret
+from app.routers import secret
+from app.schemas.secret import DecryptedSecret
+
+
+@pytest.fixture
+def client(db_session):
+    app = FastAPI()
+    app.include_router(secret.secrets_router)
+    app.dependency_overrides[get_db] = lambda: db_session
+    app.dependency_overrides[get_current_user] = lambda: None
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def batch_item(password="batch-password", **fields):
+    return {
+        "content": "batch secret",
+        "password": password,
+        "usage_limit": 1,
+        "duration": 60,
+        **fields,
+    }
+
+
+async def count_secrets(db):
+    return await maybe_await(db.scalar(select(func.count()).select_from(Secret)))
+
+
+@pytest.mark.asyncio
+async def test_post_secrets_batch_too_large(client, db_session, monkeypatch):
+    monkeypatch.setattr(secret, "SECRET_BATCH_MAX_SIZE", 2)
+
+    async with client:
+        response = await client.post("/secrets/batch", json=[batch_item()] * 3)
+
+    assert response.status_code == 413
+    assert await count_secrets(db_session) == 0
+
+
+@pytest.mark.asyncio
+async def test_post_secrets_batch_invalid_items(client, db_session):
+    items = [
+        batch_item(password="first-password", usage_limit="many"),
+        batch_item(password="second-password", duration=None),
+    ]
+
+    async with client:
+        response = await client.post("/secrets/batch", json=items)
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["index"] for result in results] == [0, 1]
+    assert [result["status_code"] for result in results] == [422, 422]
+    assert [result["uuid"] for result in results] == [None, None]
+    assert results[0]["detail"][0]["loc"] == ["usage_limit"]
+    assert results[1]["detail"][0]["loc"] == ["duration"]
+    assert "first-password" not in response.text
+    assert "second-password" not in response.text
+    assert await count_secrets(db_session) == 0
+
+
+@pytest.mark.asyncio
+async def test_post_secrets_batch_mixed_items(client, db_session):
+    items = [
+        batch_item(),
+        {"content": "no password", "usage_limit": 1, "duration": 60},
+        batch_item(),
+        batch_item(usage_limit="many"),
+    ]
+
+    async with client:
+        response = await client.post("/secrets/batch", json=items)
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["status_code"] for result in results] == [201, 422, 201, 422]
+    assert results[0]["uuid"] is not None
+    assert results[2]["uuid"] is not None
+    assert results[0]["uuid"] != results[2]["uuid"]
+    assert results[1]["detail"][0]["loc"] == ["password"]
+    assert "batch-password" not in response.text
+    assert await count_secrets(db_session) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_secret_text(client):
+    labels = {"operation": "read", "phase": "serialize"}
+    serialized = (
+        REGISTRY.get_sample_value("secret_phase_duration_seconds_count", labels) or 0
+    )
+
+    async with client:
+        created = await client.post(
+            "/secrets/text",
+            data={
+                "content": "text secret",
+                "password": "text-password",
+                "usage_limit": "1",
+                "duration": "60",
+            },
+        )
+        response = await client.get(
+            f"/secrets/{created.json()['uuid']}",
+            params={"password": "text-password"},
+        )
+
+    assert response.status_code == 200
+    # Rendered through response_model
+    assert set(response.json()) == set(DecryptedSecret.model_fields)
+    assert response.json()["content"] == "text secret"
+    assert response.json()["usage_count"] == 1
+    assert (
+        REGISTRY.get_sample_value("secret_phase_duration_seconds_count", labels)
+        == serialized + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_post_secrets_batch_non_object_item(client, db_session):
+    async with client:
+        response = await client.post(
+            "/secrets/batch", json=[batch_item(), "oops", None]
+        )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status_code"] for result in results] == [201, 422, 422]
+    assert results[1]["detail"][0]["type"] == "model_type"
+    assert "oops" not in response.text
+    assert await count_secrets(db_session) == 1
@@ -0,0 +1,88 @@
+import os
+import time
+
+import httpx
+import uvicorn
+from prometheus_client import CollectorRegistry
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from startServer import WorkerSupervisor, merge_dead_metrics
+
+
+async def app(scope, receive, send):
+    # Served by the spawned workers: answers with the pid of the worker
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(os.getpid()).encode()})
+
+
+def get_worker_pid(port: int, timeout: float = 30) -> int:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return int(httpx.get(f"http://127.0.0.1:{port}/").text)
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_supervisor_restarts_dead_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    config = uvicorn.Config(
+        "tests.test_start_server:app",
+        host="127.0.0.1",
+        port=0,
+        workers=1,
+        log_config=None,
+        lifespan="off",
+    )
+    sock = config.bind_socket()
+    port = sock.getsockname()[1]
+    supervisor = WorkerSupervisor(config, [sock])
+    supervisor.processes = [supervisor.spawn()]
+    try:
+        worker = supervisor.processes[0]
+        assert get_worker_pid(port) == worker.pid
+
+        worker.kill()
+        worker.join()
+        supervisor.restart_dead_workers()
+
+        restarted = supervisor.processes[0]
+        assert restarted.pid != worker.pid
+        assert get_worker_pid(port) == restarted.pid
+    finally:
+        supervisor.stop()
+        sock.close()
+
+    assert all(process.exitcode is not None for process in supervisor.processes)
+
+
+def write_metric(path, name: str, value: float) -> None:
+    metric = MmapedDict(str(path))
+    metric.write_value(mmap_key(name, name, [], [], "help"), value, 0.0)
+    metric.close()
+
+
+def test_merge_dead_metrics(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    write_metric(tmp_path / "counter_1.db", "requests_total", 1)
+    write_metric(tmp_path / "counter_2.db", "requests_total", 2)
+    write_metric(tmp_path / "counter_3.db", "requests_total", 4)
+    write_metric(tmp_path / "gauge_max_1.db", "info", 1)
+
+    merge_dead_metrics([1])
+    merge_dead_metrics([2])
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "counter_3.db",
+        "counter_merged.db",
+        "gauge_max_merged.db",
+    ]
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=str(tmp_path))
+    assert registry.get_sample_value("requests_total") == 7
+    assert registry.get_sample_value("info") == 1
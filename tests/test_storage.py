@@ -0,0 +1,66 @@
+import hashlib
+import io
+
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+
+from app.storage import BlobStorage, S3BlobStorage
+
+PAYLOAD = b"encrypted payload" * 100
+KEY = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    storage = S3BlobStorage("secrets")
+    with Stubber(storage.client) as stubber:
+        yield storage, stubber
+        stubber.assert_no_pending_responses()
+
+
+async def chunks():
+    for start in range(0, len(PAYLOAD), 500):
+        yield PAYLOAD[start : start + 500]
+
+
+def test_blob_storage_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStorage()
+
+
+@pytest.mark.asyncio
+async def test_s3_put_stream(s3_storage):
+    storage, stubber = s3_storage
+    stubber.add_response(
+        "put_object", {}, {"Bucket": "secrets", "Key": KEY, "Body": ANY}
+    )
+
+    assert await storage.put_stream(chunks()) == KEY
+
+
+@pytest.mark.asyncio
+async def test_s3_iter_object(s3_storage):
+    storage, stubber = s3_storage
+    stubber.add_response(
+        "get_object",
+        {"Body": StreamingBody(io.BytesIO(PAYLOAD), len(PAYLOAD))},
+        {"Bucket": "secrets", "Key": KEY},
+    )
+
+    received = [chunk async for chunk in storage.iter_object(KEY, chunk_size=600)]
+
+    assert b"".join(received) == PAYLOAD
+    assert [len(chunk) for chunk in received] == [600, 600, 500]
+
+
+@pytest.mark.asyncio
+async def test_s3_delete_object(s3_storage):
+    storage, stubber = s3_storage
+    stubber.add_response("delete_object", {}, {"Bucket": "secrets", "Key": KEY})
+
+    await storage.delete_object(KEY)
+    assert storage.local_path(KEY) is None
@@ -0,0 +1,161 @@
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from prometheus_client import REGISTRY, multiprocess
+from starlette.routing import Match
+
+from app.routers.auth import auth_router
+from app.routers.secret import secrets_router
+from app.routers.secretLogs import secrets_log_router
+from app.utils import PrometheusMiddleware, RouteIndex, phase, phase_chunks
+
+
+def create_app():
+    app = FastAPI()
+    app.include_router(auth_router)
+    app.include_router(secrets_router)
+    app.include_router(secrets_log_router)
+    return app
+
+
+def match_routes(routes, scope):
+    for route in routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return None
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [
+        ("GET", "/secrets/count"),
+        ("GET", "/secrets/7c0e1f4a-7d43-4d52-9d53-4f6b1c0b2f55"),
+        ("GET", "/secrets/7c0e1f4a-7d43-4d52-9d53-4f6b1c0b2f55/type"),
+        ("GET", "/secrets/logs/7c0e1f4a-7d43-4d52-9d53-4f6b1c0b2f55"),
+        ("GET", "/secrets/logs/"),
+        ("POST", "/secrets/text"),
+        ("POST", "/secrets/count"),
+        ("POST", "/login"),
+        ("HEAD", "/docs"),
+        ("GET", "/unknown/path"),
+        ("PROPFIND", "/secrets/count"),
+    ],
+)
+def test_route_index_matches_router(method, path):
+    app = create_app()
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+
+    assert RouteIndex(app.routes).get_path(scope) == match_routes(app.routes, scope)
+
+
+def test_route_index_keeps_route_order():
+    app = FastAPI()
+    app.add_api_route("/items/{item_id}", lambda item_id: None, methods=["GET"])
+    app.add_api_route("/items/latest", lambda: None, methods=["GET"])
+    scope = {"type": "http", "method": "GET", "path": "/items/latest"}
+
+    assert RouteIndex(app.routes).get_path(scope) == "/items/{item_id}"
+
+
+@pytest.mark.asyncio
+async def test_prometheus_middleware_streaming_response():
+    app = FastAPI()
+    app.add_middleware(PrometheusMiddleware, app_name="test-app")
+
+    async def chunks():
+        for _ in range(3):
+            yield b"x" * 1000
+
+    @app.get("/stream/{name}")
+    async def stream(name: str):
+        return StreamingResponse(chunks())
+
+    labels = {"method": "GET", "path": "/stream/{name}", "app_name": "test-app"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/stream/a")
+
+    assert response.content == b"x" * 3000
+    assert REGISTRY.get_sample_value("fastapi_requests_total", labels) == 1
+    assert (
+        REGISTRY.get_sample_value(
+            "fastapi_responses_total", {**labels, "status_code": "200"}
+        )
+        == 1
+    )
+    assert REGISTRY.get_sample_value("fastapi_responses_body_bytes_sum", labels) == 3000
+    assert (
+        REGISTRY.get_sample_value(
+            "fastapi_requests_time_to_first_byte_seconds_count", labels
+        )
+        == 1
+    )
+    assert REGISTRY.get_sample_value("fastapi_requests_in_progress", labels) == 0
+
+
+def run_worker(metrics_dir, code: str) -> str:
+    # prometheus_client reads PROMETHEUS_MULTIPROC_DIR on import, hence a process
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(metrics_dir)}
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def test_metrics_multiprocess(tmp_path):
+    record = (
+        "import os\n"
+        "from app.utils import REQUESTS, REQUESTS_IN_PROGRESS\n"
+        "labels = {'method': 'GET', 'path': '/', 'app_name': 'test-app'}\n"
+        "REQUESTS.labels(**labels).inc()\n"
+        "REQUESTS_IN_PROGRESS.labels(**labels).inc()\n"
+        "print(os.getpid())\n"
+    )
+    dead_pid = int(run_worker(tmp_path, record))
+    run_worker(tmp_path, record)
+    multiprocess.mark_process_dead(dead_pid, str(tmp_path))
+
+    output = run_worker(
+        tmp_path,
+        "from app.utils import metrics\n" "print(metrics(None).body.decode())\n",
+    )
+
+    labels = 'app_name="test-app",method="GET",path="/"'
+    assert f"fastapi_requests_total{{{labels}}} 2.0" in output
+    # The dead worker's in progress requests are gone, its counts are kept
+    assert f"fastapi_requests_in_progress{{{labels}}} 1.0" in output
+
+
+def phase_count(operation: str, name: str):
+    return REGISTRY.get_sample_value(
+        "secret_phase_duration_seconds_count",
+        {"operation": operation, "phase": name},
+    )
+
+
+def test_phase():
+    with pytest.raises(ValueError):
+        with phase("test", "fails", payload_size=3):
+            raise ValueError()
+
+    assert phase_count("test", "fails") == 1
+
+
+@pytest.mark.asyncio
+async def test_phase_chunks():
+    async def chunks():
+        for _ in range(3):
+            yield b"x" * 10
+
+    received = [chunk async for chunk in phase_chunks("test", "stream", chunks())]
+
+    assert received == [b"x" * 10] * 3
+    assert phase_count("test", "stream") == 1